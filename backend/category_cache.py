@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+"""
+CategoryCache
+    keeps the {id: type} category map in memory, tagged with the version of
+    the categories table it was loaded at. A read passing another version,
+    because a worker process changed the table since, reloads the map. An
+    optional ttl (in seconds) also reloads it periodically.
+"""
+
+
+class CategoryCache:
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.categories = None
+        self.loaded_version = None
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def clear(self):
+        """drops the cached map and resets the statistics"""
+        with self.lock:
+            self.categories = None
+            self.loaded_version = None
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, loader, version):
+        """returns the cached category map, reloading it when stale
+
+        Keyword arguments:
+        loader -- a function returning the {id: type} map from the database
+        version -- the current version of the categories table, read before loading
+        Return: the {id: type} category map
+        """
+
+        with self.lock:
+            if self._is_fresh(version):
+                self.hits += 1
+                return self.categories
+            self.misses += 1
+        categories = loader()
+        with self.lock:
+            self.categories = categories
+            self.loaded_version = version
+            self.loaded_at = time.monotonic()
+        return categories
+
+    def stats(self):
+        """returns the cache statistics as a dict"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.loaded_version or 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'ttl': self.ttl
+            }
+
+    def _is_fresh(self, version):
+        if self.categories is None or self.loaded_version != version:
+            return False
+        return self.ttl is None or time.monotonic() - self.loaded_at < self.ttl
+
+
+category_cache = CategoryCache()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+
+"""
+DataVersion
+    mirrors the data_versions table, whose rows count the changes made to
+    each table and are bumped by database triggers, so every worker process
+    sees the same versions. A response or cached value built from a table
+    is identified by the version of that table, read before building it.
+    The versions are read again once ttl seconds passed, right after a
+    write of this process, and whenever a caller asks for fresh ones, so a
+    worker acts on the changes of the others within ttl seconds.
+"""
+
+
+class DataVersion:
+
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self.counters = {}
+        self.loaded_at = None
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """makes the next read load the versions, used after a write"""
+        with self.lock:
+            self.loaded_at = None
+
+    def refresh(self, loader, fresh=False):
+        """returns the {table: version} map, loading it when expired
+
+        Keyword arguments:
+        loader -- a function returning the {table: version} map from the database
+        fresh -- load the versions even if they have not expired
+        Return: the {table: version} map
+        """
+
+        with self.lock:
+            if not fresh and self.loaded_at is not None and (
+                    self.ttl is None or time.monotonic() - self.loaded_at < self.ttl):
+                return dict(self.counters)
+        counters = loader()
+        with self.lock:
+            self.counters = dict(counters)
+            self.loaded_at = time.monotonic()
+            self.loads += 1
+        return counters
+
+    def current(self, scope):
+        """returns the version of a table, as last loaded"""
+        return self.counters.get(scope, 0)
+
+    def etag(self, scopes, versions=None):
+        """builds a strong ETag value from the versions of the given tables
+
+        Keyword arguments:
+        scopes -- the names of the tables a response is built from
+        versions -- a {table: version} map, the last loaded one by default
+        Return: the ETag value, without quotes
+        """
+
+        if versions is None:
+            versions = self.counters
+        return '-'.join('{}{}'.format(scope[0], versions.get(scope, 0)) for scope in scopes)
+
+
+data_version = DataVersion()
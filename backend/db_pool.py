@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+"""
+PoolStats
+    counts, per pool name ('primary', 'replica'), the connection checkouts,
+    the time spent waiting for a connection, the checkouts that opened an
+    overflow connection and the checkouts that timed out
+"""
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.pools = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def track(self, name, pool):
+        """makes pool the live pool reported under name"""
+        with self.lock:
+            self.pools[name] = pool
+            self.counters.setdefault(name, {
+                'checkouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                'overflows': 0, 'timeouts': 0})
+
+    def record(self, name, waited, overflow=False, timeout=False):
+        with self.lock:
+            counters = self.counters[name]
+            counters['wait_seconds'] += waited
+            counters['max_wait_seconds'] = max(counters['max_wait_seconds'], waited)
+            if timeout:
+                counters['timeouts'] += 1
+            else:
+                counters['checkouts'] += 1
+            if overflow:
+                counters['overflows'] += 1
+
+    def stats(self):
+        """returns the counters and the current state of every pool as a dict"""
+        with self.lock:
+            pools = dict(self.pools)
+            result = {name: dict(counters) for name, counters in self.counters.items()}
+        for name, pool in pools.items():
+            result[name]['checked_out'] = pool.checkedout() if hasattr(pool, 'checkedout') else None
+            result[name]['size'] = pool.size() if hasattr(pool, 'size') else 0
+            result[name]['overflow'] = max(pool.overflow(), 0) if hasattr(pool, 'overflow') else 0
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.pools.clear()
+            self.counters.clear()
+
+
+pool_stats = PoolStats()
+
+
+"""
+InstrumentedPool
+    a pool mixin timing every checkout. QueuePool._do_get calls itself, so
+    only the outermost call of a thread is measured.
+"""
+
+
+class InstrumentedPool:
+    stats_name = 'primary'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._depth = threading.local()
+        pool_stats.track(self.stats_name, self)
+
+    def _do_get(self):
+        depth = getattr(self._depth, 'value', 0)
+        if depth:
+            return super()._do_get()
+        self._depth.value = 1
+        overflow = getattr(self, '_overflow', 0)
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            pool_stats.record(self.stats_name, time.perf_counter() - started, timeout=True)
+            raise
+        finally:
+            self._depth.value = 0
+        # _overflow counts the connections opened beyond pool_size
+        opened = getattr(self, '_overflow', 0) > max(overflow, 0)
+        pool_stats.record(self.stats_name, time.perf_counter() - started, overflow=opened)
+        return connection
+
+
+def pool_class(kind, name):
+    """returns the instrumented pool class of a kind, reporting under name
+
+    Keyword arguments:
+    kind -- 'queue' for a QueuePool, 'null' for a NullPool
+    name -- the name the statistics are reported under
+    Return: a Pool subclass
+    """
+
+    base = {'queue': QueuePool, 'null': NullPool}.get(kind)
+    if base is None:
+        raise ValueError('unknown DB_POOL {}'.format(kind))
+    # a class attribute survives Pool.recreate, which builds a new instance
+    return type('Instrumented' + base.__name__, (InstrumentedPool, base), {'stats_name': name})
+
+
+def pool_options(config, database_path, name='primary'):
+    """returns the create_engine pool options set by the config or the environment
+
+    DB_POOL=null disables pooling, so that an external pooler such as
+    PgBouncer owns the connections. SQLite in-memory databases keep the
+    pool chosen by their dialect.
+
+    Keyword arguments:
+    config -- the app config, its values take precedence over the environment
+    database_path -- the URI of the database the options are for
+    name -- the name the pool statistics are reported under
+    Return: a dict of engine options
+    """
+
+    def setting(key, convert):
+        value = config.get(key, os.getenv(key))
+        if value is None or value == '':
+            return None
+        if convert is bool and isinstance(value, str):
+            return value.lower() in ('1', 'true', 'yes', 'on')
+        return convert(value)
+
+    options = {}
+    pre_ping = setting('DB_POOL_PRE_PING', bool)
+    if pre_ping is not None:
+        options['pool_pre_ping'] = pre_ping
+    recycle = setting('DB_POOL_RECYCLE', int)
+    if recycle is not None:
+        options['pool_recycle'] = recycle
+    if database_path.startswith('sqlite') and (
+            ':memory:' in database_path or database_path in ('sqlite://', 'sqlite:///')):
+        return options
+    kind = (setting('DB_POOL', str) or 'queue').lower()
+    options['poolclass'] = pool_class(kind, name)
+    if kind == 'queue':
+        for key, option, convert in (('DB_POOL_SIZE', 'pool_size', int),
+                                     ('DB_MAX_OVERFLOW', 'max_overflow', int),
+                                     ('DB_POOL_TIMEOUT', 'pool_timeout', float)):
+            value = setting(key, convert)
+            if value is not None:
+                options[option] = value
+    return options
@@ -1,19 +1,106 @@
+import time
 import json
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from random import randint
 
 
-from models import setup_db, Question, Category
+from models import setup_db, database_path, Question, Category
+from category_cache import category_cache
+from data_version import data_version
+from question_counts import question_counts
+from response_cache import response_cache
+from search_index import text_index
+from quiz_buckets import quiz_buckets, QUIZ_MODES, valid_mix
+from .categories import get_categories, category_cache_metrics
+from .pagination import paginate_request, paginate_query
+from .counts import total_questions, category_question_counts, category_question_count
+from .quiz import sample_question, sample_questions
+from .quiz_sessions import MemoryQuizSessionStore, start_session, next_session_question
+from .search import search_questions, build_text_index
+from .ingest import decode_lines, iter_ndjson, iter_csv, ingest_questions
+from .export import export_criteria, export_questions
+from .metrics import init_metrics, pool_metrics
+from .etag import conditional
+from .caching import cached_list, response_cache_metrics
+from .routing import init_routing, replica_metrics
+from .admission import init_admission, retry_after_header
+from .autocomplete import autocomplete
+from .compression import init_compression
+from .startup import init_db_command, start_warming, boot_metrics_collector
+from .serialization import init_json, parse_fields, question_query, rows_to_dicts
 
 QUESTIONS_PER_PAGE = 10
+BULK_BATCH_SIZE = 1000
+MAX_QUIZ_BATCH = 50
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 25
+# concurrent requests allowed per endpoint, the rest queue up to a limit or get a 503
+ADMISSION_LIMITS = {
+    'get_question_by_search': {'concurrency': 8, 'queue': 16, 'timeout': 2.0},
+    'get_random_question': {'concurrency': 16, 'queue': 32, 'timeout': 1.0},
+    'get_random_questions': {'concurrency': 8, 'queue': 16, 'timeout': 1.0},
+    'start_quiz_session': {'concurrency': 8, 'queue': 16, 'timeout': 1.0},
+    'bulk_import_questions': {'concurrency': 2, 'queue': 2, 'timeout': 5.0, 'retry_after': 5}
+}
 
 
 def create_app(test_config=None):
     # create and configure the app
+    started = time.perf_counter()
     app = Flask(__name__)
-    setup_db(app)
+    if test_config:
+        app.config.from_mapping(test_config)
+    # LAZY_STARTUP leaves the schema to `flask init-db` and the caches to the first requests
+    lazy = app.config.get('LAZY_STARTUP', False)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+             app.config.get('SQLALCHEMY_REPLICA_URI'), create_all=not lazy)
+    boot_timings = app.extensions['boot_timings'] = {'setup_db': time.perf_counter() - started}
+    # IMPORT_SECONDS is measured by the entry point importing flaskr, see wsgi.py
+    if app.config.get('IMPORT_SECONDS') is not None:
+        boot_timings['import'] = app.config['IMPORT_SECONDS']
+    init_db_command(app)
+    # seconds the table versions shared by the workers are reused before being read again
+    data_version.invalidate()
+    data_version.ttl = app.config.get('DATA_VERSION_TTL', 1.0)
+    # seconds before the category map is reloaded even without a change
+    category_cache.clear()
+    category_cache.ttl = app.config.get('CATEGORY_CACHE_TTL')
+    # seconds before the question counts are reloaded even without a change
+    question_counts.invalidate()
+    question_counts.ttl = app.config.get('QUESTION_COUNT_TTL')
+    # bounded LRU of encoded list responses, invalidated per category
+    response_cache.clear()
+    response_cache.max_entries = app.config.get('RESPONSE_CACHE_SIZE', 1024)
+    response_cache.ttl = app.config.get('RESPONSE_CACHE_TTL')
+    # per-request latency, SQL counts and /metrics, SERVER_TIMING adds the header
+    metrics = init_metrics(app)
+    # gzip/brotli for clients accepting it, bodies of versioned responses compressed once
+    metrics.register_collector(init_compression(app))
+    # JSON_ENCODER picks orjson or the stdlib encoder for every response
+    init_json(app)
+    metrics.register_collector(category_cache_metrics)
+    metrics.register_collector(response_cache_metrics)
+    metrics.register_collector(pool_metrics)
+    metrics.register_collector(boot_metrics_collector(app))
+    # reads go to SQLALCHEMY_REPLICA_URI when set, except right after a write
+    init_routing(app)
+    metrics.register_collector(replica_metrics)
+    # ADMISSION_LIMITS entries override the defaults per endpoint, None lifts a limit
+    metrics.register_collector(init_admission(
+        app, dict(ADMISSION_LIMITS, **app.config.get('ADMISSION_LIMITS', {}))))
+    # (category, difficulty) id buckets quiz questions are drawn from, built on first use
+    quiz_buckets.invalidate()
+    quiz_buckets.ttl = app.config.get('QUIZ_BUCKETS_TTL')
+    # index over question text and category names serving the typeahead, and the searches
+    # when the database has no full-text search, kept up to date by the models
+    text_index.invalidate()
+    text_index.ttl = app.config.get('SEARCH_INDEX_TTL')
+    if not lazy:
+        with app.app_context():
+            build_text_index()
+    # server-side quiz sessions, kept in memory unless another store is configured
+    quiz_sessions = app.config.get('QUIZ_SESSION_STORE') or MemoryQuizSessionStore()
     CORS(app, resources={r"*": {'origins': '*'}})
 
     # CORS Headers
@@ -26,66 +113,63 @@ def create_app(test_config=None):
                              'GET,PUT,POST,DELETE,PATCH')
         return response
 
-    # method to paginate display
-    def paginate_display(request, selected_questions):
-        """displays the number of questions per page
-
-        Keyword arguments:
-        request -- method to get the page number
-        selected_questions -- a list of questions from the database
-        Return: returns a specific number of items per page
-        """
-
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        return [single_question.format() for single_question in selected_questions[start:end]]
-
     # endpoint to get all categories
     @app.route('/api/categories', methods=['GET'])
+    @conditional('categories', 'questions')
     def get_all_categories():
         """get all the categories in the database
 
         Keyword arguments:
+        counts -- when 'true', also return the number of questions per category
         Return: returns a list of categories in a JSON bdy upon successful request
         """
 
         try:
-            # get all categories in a list format
-            all_categories = [
-                category.format() for category in Category.query.order_by(Category.id).all()]
-
-            return jsonify({
+            # the {id: type} map is served from the category cache
+            response = {
                 'success': True,
-                # zip a list of category ids and category type
-                'categories': dict(zip([values.get('id') for values in all_categories], [values.get('type') for values in all_categories]))
-            })
+                'categories': get_categories()
+            }
+            # the per-category question counts are read from the maintained counts
+            if request.args.get('counts', 'false') == 'true':
+                counts = category_question_counts()
+                response['category_counts'] = {
+                    id: counts.get(id, 0) for id in response['categories']}
+            return jsonify(response)
         except:
             abort(405)
 
     # endpoint to get paginated question
     @app.route('/api/questions', methods=['GET'])
+    @conditional('questions', 'categories')
+    @cached_list
     def get_all_questions():
         """returns all questions in the database, and paginate them
 
         Keyword arguments:
-
+        fields -- optional comma separated question columns, or 'summary'
         Return: a list of questions and categories in the database in a JSON body
         """
         try:
-            all_categories = [
-                category.format() for category in Category.query.order_by(Category.id).all()]
-            grab_questions = Question.query.order_by(Question.id).all()
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError:
+            abort(400)
+        try:
+            all_categories = get_categories()
             if len(all_categories) == 0:
                 abort(404)
             else:
-                questions = paginate_display(request, grab_questions) if paginate_display(
-                    request, grab_questions) else abort(400)
+                # the page (or the keyset after_id) is resolved by the database
+                questions = rows_to_dicts(paginate_request(
+                    request, question_query(fields), Question.id, QUESTIONS_PER_PAGE), fields)
+                if not questions:
+                    abort(400)
                 return jsonify({
                     'success': True,
                     'questions': questions,
-                    'total_questions': len(Question.query.all()),
-                    'categories': dict(zip([i.get('id') for i in all_categories], [i.get('type') for i in all_categories])),
+                    'total_questions': total_questions(),
+                    'next_after_id': questions[-1].get('id'),
+                    'categories': all_categories,
                     'current_category': 'History'
                 })
         except:
@@ -93,25 +177,37 @@ def create_app(test_config=None):
 
     # end point to get questions per category selected
     @app.route('/api/categories/<int:id>/questions', methods=['GET'])
+    @conditional('questions')
+    @cached_list
     def get_questions_per_category(id):
-        """returns all questions based on a category
+        """returns all questions based on a category, or a page of them
 
         Keyword arguments:
         id -- id of the category
+        page -- optional page number, all questions are returned without it
+        fields -- optional comma separated question columns, or 'summary'
         Return: category questions
         """
-        # check if the id exists
-        if (Question.query.filter(Question.category == id).first() == None):
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError:
+            abort(400)
+        # check if the category has questions, using the maintained counts
+        category_total = category_question_count(id)
+        if category_total == 0:
             abort(404)
         else:
             try:
-                questions = Question.query.order_by(
-                    Question.id).filter(Question.category == id).all()
+                query = question_query(fields).filter(
+                    Question.category == id).order_by(Question.id)
+                page = request.args.get('page', type=int)
+                questions = paginate_query(
+                    query, page, QUESTIONS_PER_PAGE) if page else query.all()
 
                 return jsonify({
                     'success': True,
-                    'questions': [question.format() for question in questions],
-                    'totalQuestions': len(questions),
+                    'questions': rows_to_dicts(questions, fields),
+                    'totalQuestions': category_total,
                     'currentCategory': 'History'
                 })
             except:
@@ -135,18 +231,90 @@ def create_app(test_config=None):
                 new_question = Question(question=body.get('question'), answer=body.get(
                     'answer'), category=body.get('category'), difficulty=body.get('difficulty'))
                 new_question.insert()
-                get_all_current_questions = Question.query.order_by(
-                    Question.id).all()
-                paginated_question = paginate_display(request,
-                                                      get_all_current_questions)
                 return jsonify({
                     'success': True,
                     'created': new_question.id,
-                    'total_questions': len(Question.query.all()),
+                    'total_questions': total_questions(),
                 })
             except:
                 abort(405)
 
+    # end point to import many questions at once
+    @app.route('/api/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        """streams NDJSON or CSV questions into the database in batches
+
+        Keyword arguments:
+        body -- application/x-ndjson with one question object per line, or
+        text/csv with a question,answer,category,difficulty header
+        batch_size -- the number of questions inserted per commit
+        Return: the number of inserted and failed rows and the row errors
+        """
+
+        if request.mimetype in ('application/x-ndjson', 'application/jsonlines'):
+            parse = iter_ndjson
+        elif request.mimetype == 'text/csv':
+            parse = iter_csv
+        else:
+            abort(400)
+        batch_size = request.args.get('batch_size', app.config.get(
+            'BULK_BATCH_SIZE', BULK_BATCH_SIZE), type=int)
+        if batch_size < 1:
+            abort(400)
+        try:
+            # the body is parsed while it is read, it is never held in memory
+            inserted, failed, errors = ingest_questions(
+                parse(decode_lines(request.stream)), get_categories(), batch_size)
+        except UnicodeDecodeError:
+            abort(422)
+        if inserted == 0 and failed == 0:
+            abort(422)
+        return jsonify({
+            'success': failed == 0,
+            'inserted': inserted,
+            'failed': failed,
+            'errors': errors,
+            'total_questions': total_questions()
+        })
+
+    # end point to export the question bank
+    @app.route('/api/questions/export', methods=['GET'])
+    def export_all_questions():
+        """streams questions as NDJSON, one question object per line
+
+        Keyword arguments:
+        category -- only export questions of this category id
+        difficulty -- only export questions of this difficulty
+        after_id -- resume an interrupted export after this question id
+        Return: an application/x-ndjson stream ordered by question id
+        """
+
+        criteria = export_criteria(category=request.args.get('category', type=int),
+                                   difficulty=request.args.get('difficulty', type=int),
+                                   after_id=request.args.get('after_id', type=int))
+        return Response(stream_with_context(export_questions(criteria)),
+                        mimetype='application/x-ndjson')
+
+    # end point to complete a partially typed search
+    @app.route('/api/autocomplete', methods=['GET'])
+    def get_autocomplete():
+        """suggests questions and categories for a partially typed search
+
+        Keyword arguments:
+        q -- what the user typed so far, the last word matches as a prefix
+        limit -- the maximum number of suggestions, up to 25
+        Return: the best matching categories and questions, from memory
+        """
+
+        text = request.args.get('q', '')
+        limit = request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int)
+        if not text.strip() or not 1 <= limit <= MAX_AUTOCOMPLETE_LIMIT:
+            abort(400)
+        return jsonify({
+            'success': True,
+            'suggestions': autocomplete(text, limit)
+        })
+
     # end point to search for a question
     @app.route('/api/questions/search', methods=['POST'])
     def get_question_by_search():
@@ -154,27 +322,38 @@ def create_app(test_config=None):
 
         Keyword arguments:
         searchTerm -- the word or phrase to be searched
-        Return: returns a list of question or questions upon successful request
+        page -- the page of ranked results, starting from 1
+        fields -- optional question columns (comma separated or a list), or 'summary'
+        Return: returns a page of matching questions upon successful request
         """
 
+        body = request.get_json()
         # get search word/phrase
-        searchTerm = request.get_json().get('searchTerm')
-        # if none abort 422
-        if searchTerm == '':
+        searchTerm = body.get('searchTerm')
+        # if none abort 404
+        if not searchTerm:
             abort(404)
         else:
             try:
-                # query database to get all that match the searched word or phrase
-                get_questions = Question.query.order_by(Question.id).filter(
-                    Question.question.ilike(f'%{searchTerm}%')).all()
+                fields = body.get('fields', request.args.get('fields'))
+                if isinstance(fields, list):
+                    fields = ','.join(fields)
+                fields = parse_fields(fields)
+            except (TypeError, ValueError):
+                abort(400)
+            try:
+                page = body.get('page', request.args.get('page', 1, type=int))
+                # the search index ranks the matches and returns a single page
+                get_questions, total_questions = search_questions(
+                    searchTerm, int(page), QUESTIONS_PER_PAGE, fields)
                 # return 404 if result is 0
                 if len(get_questions) == 0:
                     abort(404)
                 else:
                     return jsonify({
                         'success': True,
-                        'questions': [question.format() for question in get_questions],
-                        'total_questions': len(get_questions),
+                        'questions': get_questions,
+                        'total_questions': total_questions,
                         'current_category': 'Sports'
                     })
             except:
@@ -188,54 +367,155 @@ def create_app(test_config=None):
         Keyword arguments:
         previous_questions -- a list of previous questions ids
         quiz_category -- an object containing type and category id
+        difficulty -- optional difficulty, or list of difficulties, the question must have
+        mode -- 'random' (default), 'ramp' to raise the difficulty as the quiz goes on,
+                or 'mix' to follow the difficulty weights given in mix
+        mix -- {difficulty: weight} for the mix mode
+        ramp_every -- questions asked per difficulty in the ramp mode, 2 by default
         Return: returns a single random question
         """
 
         body = request.get_json()
-        previous_questions = body.get('previous_questions')
         quiz_category = body.get('quiz_category')
         if not quiz_category:
             abort(400)
+        try:
+            difficulty = body.get('difficulty')
+            difficulties = None if difficulty is None else {
+                int(value) for value in (difficulty if isinstance(difficulty, list) else [difficulty])}
+            mode = body.get('mode', 'random')
+            mix = {int(level): float(weight) for level, weight in (body.get('mix') or {}).items()}
+            ramp_every = int(body.get('ramp_every', 2))
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+        if mode not in QUIZ_MODES or (mode == 'mix' and not valid_mix(mix)) or ramp_every < 1:
+            abort(400)
         else:
             try:
-                if (quiz_category.get('id') == 0) and (len(previous_questions) >= 0):
-                    questions = [question.format()
-                                 for question in Question.query.all()]
-                elif(quiz_category.get('id') != 0 and (len(previous_questions) >= 0)):
-                    questions = [question.format()
-                                 for question in Question.query.filter(Question.category == int(quiz_category.get('id'))).all()]
-                # generate a random number within the range of
-                # the list returned by getting the size of the list
-                random_number = randint(0, len(questions)-1)
-                # grab a random question using the generated number
-                random_question = questions[random_number]
-                go_ahead = True     # setting a condition
-                # indicates that there are no more questions as soon as the length
-                # of questions fetched is equal to the length of the previous question
-                # hence should return the score
-                if len(previous_questions) == len(questions):
-                    go_ahead = False
+                previous_questions = [int(id) for id in body.get('previous_questions') or []]
+                category_id = int(quiz_category.get('id', 0))
+                # unknown categories are rejected from the category cache
+                if category_id and category_id not in get_categories():
+                    abort(404)
+                # the question is drawn from the in-memory (category, difficulty) buckets
+                random_question = sample_question(
+                    category_id, previous_questions, difficulties, mode, mix, ramp_every)
+                # indicates that there are no more questions in the category,
+                # hence the client should show the score
+                if random_question is None:
                     return jsonify({"success": False, "question": False})
-                else:
-                    while(go_ahead):
-                        if(random_question.get('id') in previous_questions):
-                            random_number = randint(0, len(questions)-1)
-                            random_question = questions[random_number]
-                            pass
-                        elif(random_question.get('id') not in previous_questions):
-                            return jsonify({
-                                'success': True,
-                                'question': random_question
-                            })
-
-                        else:
-                            go_ahead = False
-                            previous_questions.clear()
-                            return jsonify({"success": False, "question": False})
-
+                return jsonify({
+                    'success': True,
+                    'question': random_question.format()
+                })
             except:
                 abort(404)
 
+    # end point to get several random questions in one round trip
+    @app.route('/api/quizzes/batch', methods=['POST'])
+    def get_random_questions():
+        """returns up to count distinct random questions, none of them in the previous questions
+
+        Keyword arguments:
+        previous_questions -- a list of previous questions ids
+        quiz_category -- an object containing type and category id
+        count -- the number of questions wanted, at most 50
+        stratify -- when true, spread the questions evenly over the difficulties
+        Return: a list of random questions
+        """
+
+        body = request.get_json()
+        quiz_category = body.get('quiz_category') if body else None
+        if not quiz_category:
+            abort(400)
+        try:
+            category_id = int(quiz_category.get('id', 0))
+            count = int(body.get('count', QUESTIONS_PER_PAGE))
+            previous_questions = [int(id) for id in body.get('previous_questions') or []]
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+        if not 1 <= count <= MAX_QUIZ_BATCH:
+            abort(400)
+        if category_id and category_id not in get_categories():
+            abort(404)
+        questions = sample_questions(category_id, previous_questions,
+                                     count, stratify=bool(body.get('stratify')))
+        # no questions left in the category, hence the client should show the score
+        return jsonify({
+            'success': len(questions) > 0,
+            'questions': questions
+        })
+
+    # end point to start a quiz session
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        """starts a quiz played on the server, the client only keeps the token
+
+        Keyword arguments:
+        quiz_category -- an object containing type and category id
+        Return: the session token and the number of questions in the quiz
+        """
+
+        body = request.get_json()
+        quiz_category = body.get('quiz_category') if body else None
+        if not quiz_category:
+            abort(400)
+        try:
+            category_id = int(quiz_category.get('id', 0))
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+        if category_id and category_id not in get_categories():
+            abort(404)
+        token, session = start_session(quiz_sessions, category_id)
+        return jsonify({
+            'success': True,
+            'token': token,
+            'total_questions': len(session.deck)
+        })
+
+    # end point to get the next question of a quiz session
+    @app.route('/api/quizzes/sessions/<token>/next', methods=['POST'])
+    def get_next_session_question(token):
+        """returns the next unanswered question of a quiz session
+
+        Keyword arguments:
+        token -- the token returned when the session started
+        skip -- when true, the question served last comes again after the others
+        Return: a single question, or question false when the quiz is over
+        """
+
+        session = quiz_sessions.get(token)
+        if session is None:
+            abort(404)
+        body = request.get_json(silent=True)
+        skip = isinstance(body, dict) and bool(body.get('skip'))
+        question = next_session_question(quiz_sessions, token, session, skip)
+        # the deck is empty, hence the client should show the score
+        if question is None:
+            return jsonify({"success": False, "question": False})
+        return jsonify({
+            'success': True,
+            'question': question.format(),
+            'remaining': session.remaining
+        })
+
+    # end point to end a quiz session
+    @app.route('/api/quizzes/sessions/<token>', methods=['DELETE'])
+    def end_quiz_session(token):
+        """drops a quiz session
+
+        Keyword arguments:
+        token -- the token returned when the session started
+        Return: 200 upon successful deletion
+        """
+
+        if not quiz_sessions.delete(token):
+            abort(404)
+        return jsonify({
+            'success': True,
+            'deleted': token
+        })
+
     # end point to create a new category
     @ app.route('/api/categories/new-category', methods=['POST'])
     def create_new_category():
@@ -253,8 +533,8 @@ def create_app(test_config=None):
             try:
                 new_category = Category(type=body.get('category'))
                 new_category.insert()
-                get_all_current_categories = [category.format() for category in Category.query.order_by(
-                    Category.id).all()]
+                get_all_current_categories = [{'id': id, 'type': type}
+                                              for id, type in get_categories().items()]
                 return jsonify({
                     'success': True,
                     'created': new_category.id,
@@ -283,7 +563,7 @@ def create_app(test_config=None):
                 return jsonify({
                     'success': True,
                     'deleted': id,
-                    'total_questions': len(Question.query.all())
+                    'total_questions': total_questions()
                 })
         except:
             abort(422)
@@ -329,4 +609,17 @@ def create_app(test_config=None):
             'message': 'Internal Server Error'
         }), 500
 
+    @ app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            'success': False,
+            'error': 503,
+            'message': 'Service Unavailable'
+        }), 503, retry_after_header()
+
+    boot_timings['create_app'] = time.perf_counter() - started
+    app.logger.info('app created in %.3fs', boot_timings['create_app'])
+    # WARM_CACHES loads the caches in the background instead of on the first requests
+    if app.config.get('WARM_CACHES'):
+        start_warming(app)
     return app
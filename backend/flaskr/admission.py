@@ -0,0 +1,139 @@
+import math
+import threading
+import time
+
+from flask import abort, g, request
+
+
+"""
+ConcurrencyLimiter
+    lets at most concurrency requests of an endpoint run at once. Up to
+    queue more wait, each for at most timeout seconds, for a slot to free
+    up. The requests beyond that are shed right away, so a spike costs the
+    rejected clients a fast 503 instead of slowing down every request.
+"""
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, concurrency, queue=0, timeout=1.0, retry_after=1):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = {'queue_full': 0, 'queue_timeout': 0}
+        self.queue_seconds = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """takes a slot, waiting in the queue if needed
+
+        Return: True once a slot is taken, False if the request is shed
+        """
+
+        with self.condition:
+            if self.active < self.concurrency and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.shed['queue_full'] += 1
+                return False
+            self.waiting += 1
+            started = time.monotonic()
+            deadline = started + self.timeout
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed['queue_timeout'] += 1
+                        return False
+                    self.condition.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+                self.queue_seconds += time.monotonic() - started
+
+    def release(self):
+        """frees the slot of a finished request"""
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stats(self):
+        """returns the limiter statistics as a dict"""
+        with self.condition:
+            return {
+                'concurrency': self.concurrency,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'queue_seconds': self.queue_seconds
+            }
+
+
+def init_admission(app, limits):
+    """limits the concurrent requests of the given endpoints of an app
+
+    A shed request is answered with 503 and a Retry-After header.
+
+    Keyword arguments:
+    app -- the flask application
+    limits -- {endpoint: {'concurrency': n, 'queue': n, 'timeout': seconds,
+              'retry_after': seconds}}, endpoints without an entry are not limited
+    Return: a metrics collector reporting the limiter statistics
+    """
+
+    limiters = {endpoint: ConcurrencyLimiter(**settings)
+                for endpoint, settings in limits.items() if settings}
+
+    @app.before_request
+    def admit_request():
+        limiter = limiters.get(request.endpoint)
+        if limiter is None:
+            return
+        if not limiter.acquire():
+            g.retry_after = limiter.retry_after
+            abort(503)
+        g.admission_limiter = limiter
+
+    @app.teardown_request
+    def release_request(exception=None):
+        limiter = g.pop('admission_limiter', None)
+        if limiter is not None:
+            limiter.release()
+
+    def admission_metrics():
+        """reports the admission control statistics to the metrics registry"""
+        stats = {endpoint: limiter.stats() for endpoint, limiter in sorted(limiters.items())}
+        return [
+            ('trivia_admission_active', 'gauge',
+             'Requests running under a concurrency limit, by endpoint.',
+             [({'endpoint': endpoint}, s['active']) for endpoint, s in stats.items()]),
+            ('trivia_admission_waiting', 'gauge',
+             'Requests waiting for a slot, by endpoint.',
+             [({'endpoint': endpoint}, s['waiting']) for endpoint, s in stats.items()]),
+            ('trivia_admission_admitted_total', 'counter',
+             'Requests admitted by the concurrency limiter, by endpoint.',
+             [({'endpoint': endpoint}, s['admitted']) for endpoint, s in stats.items()]),
+            ('trivia_admission_shed_total', 'counter',
+             'Requests answered with 503, by endpoint and reason.',
+             [({'endpoint': endpoint, 'reason': reason}, count)
+              for endpoint, s in stats.items() for reason, count in sorted(s['shed'].items())]),
+            ('trivia_admission_queue_seconds_total', 'counter',
+             'Time requests spent waiting for a slot, by endpoint.',
+             [({'endpoint': endpoint}, s['queue_seconds']) for endpoint, s in stats.items()])
+        ]
+
+    return admission_metrics
+
+
+def retry_after_header():
+    """returns the Retry-After header of a shed request, in whole seconds"""
+    return {'Retry-After': str(int(math.ceil(g.get('retry_after', 1))))}
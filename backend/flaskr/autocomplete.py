@@ -0,0 +1,16 @@
+from search_index import text_index
+from .search import build_text_index
+
+
+def autocomplete(text, limit):
+    """returns the questions and categories matching a partially typed text
+
+    Keyword arguments:
+    text -- what the user typed so far
+    limit -- the maximum number of suggestions
+    Return: a list of {'type', 'id', 'text'} dicts, best matches first
+    """
+
+    build_text_index()
+    return [{'type': kind, 'id': doc_id, 'text': text}
+            for kind, doc_id, text in text_index.complete(text, limit)]
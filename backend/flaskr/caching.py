@@ -0,0 +1,56 @@
+from functools import wraps
+
+from flask import make_response, request
+
+from response_cache import response_cache
+from .versions import current_versions
+
+
+def cached_list(view):
+    """serves a GET list view from the response cache
+
+    The cache key is (endpoint, category, page, fields, versions), where
+    category is the id view argument of per-category lists and None for
+    lists spanning every category, and versions are the table versions
+    shared by every worker process. A change made by another worker moves
+    the versions, so the entries cached before it are no longer looked up.
+
+    Keyword arguments:
+    view -- the view function to cache
+    Return: the wrapped view
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.endpoint, kwargs.get('id'),
+               (request.args.get('page'), request.args.get('after_id')),
+               request.args.get('fields'), tuple(sorted(current_versions().items())))
+        cached = response_cache.get(key)
+        if cached is not None:
+            body, mimetype = cached
+            response = make_response(body)
+            response.mimetype = mimetype
+            return response
+        generation = response_cache.generation(key[1])
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            response_cache.put(key, (response.get_data(), response.mimetype), generation)
+        return response
+    return wrapper
+
+
+def response_cache_metrics():
+    """reports the response cache statistics to the metrics registry"""
+    stats = response_cache.stats()
+    return [
+        ('trivia_response_cache_hits_total', 'counter',
+         'List responses served from the response cache.', [({}, stats['hits'])]),
+        ('trivia_response_cache_misses_total', 'counter',
+         'List responses built by their view.', [({}, stats['misses'])]),
+        ('trivia_response_cache_evictions_total', 'counter',
+         'Entries evicted from the response cache.', [({}, stats['evictions'])]),
+        ('trivia_response_cache_invalidations_total', 'counter',
+         'Entries dropped because their data changed.', [({}, stats['invalidations'])]),
+        ('trivia_response_cache_entries', 'gauge',
+         'Entries held by the response cache.', [({}, stats['entries'])])
+    ]
@@ -0,0 +1,27 @@
+from category_cache import category_cache
+from models import read_session, Category
+from .versions import current_versions
+
+
+def load_categories():
+    """reads the {id: type} category map from the database"""
+    return {category.id: category.type for category in read_session().query(Category).order_by(
+        Category.id)}
+
+
+def get_categories():
+    """returns the {id: type} category map, served from the category cache"""
+    return category_cache.get(load_categories, current_versions().get('categories', 0))
+
+
+def category_cache_metrics():
+    """reports the category cache statistics to the metrics registry"""
+    stats = category_cache.stats()
+    return [
+        ('trivia_category_cache_hits_total', 'counter',
+         'Category map reads served from the cache.', [({}, stats['hits'])]),
+        ('trivia_category_cache_misses_total', 'counter',
+         'Category map reads that went to the database.', [({}, stats['misses'])]),
+        ('trivia_category_cache_version', 'gauge',
+         'Version of the category map.', [({}, stats['version'])])
+    ]
@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are gzipped without it
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+# content codings, appended to the ETag of a compressed response
+CONTENT_CODINGS = ('br', 'gzip')
+
+
+def compress(data, encoding, level):
+    """compresses a body with gzip or brotli
+
+    Keyword arguments:
+    data -- the bytes to compress
+    encoding -- 'gzip' or 'br'
+    level -- the gzip level (1-9) or the brotli quality (0-11)
+    Return: the compressed bytes
+    """
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+"""
+CompressedBodies
+    a bounded LRU of compressed response bodies, keyed by a digest of the
+    uncompressed body and the encoding, so a body is compressed once and
+    a changed body, even under an unchanged URL and ETag, never gets the
+    bytes of an older one.
+"""
+
+
+class CompressedBodies:
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            if self.max_entries <= 0:
+                return
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def init_compression(app):
+    """compresses the responses of an app for clients accepting gzip or brotli
+
+    Bodies shorter than COMPRESS_MIN_SIZE bytes are sent as they are.
+    The compressed bodies of GET responses carrying an ETag are kept for
+    reuse, and the ETag gets the encoding as a suffix (e.g. "...-gzip"), so
+    every strong validator covers a single byte sequence.
+
+    Keyword arguments:
+    app -- the flask application
+    Return: a metrics collector reporting the compression statistics
+    """
+
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+    levels = {'gzip': app.config.get('COMPRESS_LEVEL', 6),
+              'br': app.config.get('COMPRESS_BROTLI_LEVEL', 5)}
+    encodings = list(CONTENT_CODINGS) if brotli is not None else ['gzip']
+    bodies = CompressedBodies(app.config.get('COMPRESS_CACHE_SIZE', 256))
+    stats = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0}
+    lock = threading.Lock()
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 or response.is_streamed or \
+                response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+                'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+        etag, weak = response.get_etag()
+        key = (hashlib.blake2b(data, digest_size=16).digest(), encoding) \
+            if etag and request.method == 'GET' else None
+        body = bodies.get(key) if key is not None else None
+        if body is None:
+            body = compress(data, encoding, levels[encoding])
+            if key is not None:
+                bodies.put(key, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag('{}-{}'.format(etag, encoding), weak)
+        with lock:
+            stats['responses'] += 1
+            stats['bytes_in'] += len(data)
+            stats['bytes_out'] += len(body)
+        return response
+
+    def compression_metrics():
+        """reports the compression statistics to the metrics registry"""
+        with lock:
+            current = dict(stats)
+        return [
+            ('trivia_compressed_responses_total', 'counter',
+             'Responses sent compressed.', [({}, current['responses'])]),
+            ('trivia_compression_bytes_in_total', 'counter',
+             'Bytes of the compressed responses before compression.', [({}, current['bytes_in'])]),
+            ('trivia_compression_bytes_out_total', 'counter',
+             'Bytes of the compressed responses after compression.', [({}, current['bytes_out'])]),
+            ('trivia_compression_cache_hits_total', 'counter',
+             'Compressed bodies reused instead of compressed again.', [({}, bodies.hits)]),
+            ('trivia_compression_cache_misses_total', 'counter',
+             'Versioned bodies compressed and kept for reuse.', [({}, bodies.misses)])
+        ]
+
+    return compression_metrics
@@ -0,0 +1,51 @@
+from sqlalchemy import exists
+
+from models import read_session, Question, QuestionCount
+from question_counts import question_counts
+from .versions import current_versions
+
+
+def load_question_counts():
+    """reads the {category: count} map from the question_counts table
+
+    Questions without a category are counted under category 0, which is
+    mapped back to None.
+    """
+
+    return {category or None: total for category, total in read_session().query(
+        QuestionCount.category, QuestionCount.total) if total > 0}
+
+
+def total_questions():
+    """returns the number of questions, served from the maintained counts"""
+    return question_counts.total(load_question_counts, current_versions().get('questions', 0))
+
+
+def category_question_counts(fresh=False):
+    """returns the {category: count} map, served from the maintained counts
+
+    Keyword arguments:
+    fresh -- read the table versions now, even if DATA_VERSION_TTL has not expired
+    Return: the {category: count} map
+    """
+
+    return question_counts.by_category(
+        load_question_counts, current_versions(fresh).get('questions', 0))
+
+
+def category_question_count(category):
+    """returns the number of questions in a category, served from the maintained counts
+
+    A zero count is confirmed with an EXISTS query, since the category may
+    have been filled by another worker process within DATA_VERSION_TTL. The
+    versions are read again when it was.
+
+    Keyword arguments:
+    category -- the category id
+    Return: the number of questions in the category
+    """
+
+    count = category_question_counts().get(category, 0)
+    if count == 0 and read_session().query(exists().where(Question.category == category)).scalar():
+        count = category_question_counts(fresh=True).get(category, 0)
+    return count
@@ -0,0 +1,44 @@
+from functools import wraps
+
+from flask import make_response, request
+
+from data_version import data_version
+from .compression import CONTENT_CODINGS
+from .versions import current_versions
+
+
+def conditional(*scopes):
+    """adds ETag / If-None-Match support to a GET view
+
+    The ETag is derived from the versions of the given tables, which every
+    worker process reads from the data_versions table. An unchanged
+    resource is answered with 304 before the view runs, from versions at
+    most DATA_VERSION_TTL seconds old. Otherwise the versions are read again
+    before and after the view, and the response only gets an ETag when no
+    write committed in between, so an ETag never covers two bodies. The
+    ETags of compressed responses, suffixed with their encoding, match as
+    well.
+
+    Keyword arguments:
+    scopes -- the names of the tables the response is built from
+    Return: a view decorator
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = data_version.etag(scopes, current_versions())
+            for candidate in [etag] + ['{}-{}'.format(etag, coding) for coding in CONTENT_CODINGS]:
+                if request.if_none_match.contains_weak(candidate):
+                    response = make_response('', 304)
+                    response.set_etag(candidate)
+                    response.vary.add('Accept-Encoding')
+                    return response
+            etag = data_version.etag(scopes, current_versions(fresh=True))
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and \
+                    data_version.etag(scopes, current_versions(fresh=True)) == etag:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,44 @@
+from models import Question
+from .serialization import QUESTION_FIELDS, question_query, current_encoder
+
+
+# the number of rows fetched from the server-side cursor at a time
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_criteria(category=None, difficulty=None, after_id=None):
+    """builds the filters of an export
+
+    Keyword arguments:
+    category -- only export questions of this category id
+    difficulty -- only export questions of this difficulty
+    after_id -- resume after the last question id already received
+    Return: a list of SQLAlchemy filter expressions
+    """
+
+    criteria = []
+    if category is not None:
+        criteria.append(Question.category == category)
+    if difficulty is not None:
+        criteria.append(Question.difficulty == difficulty)
+    if after_id is not None:
+        criteria.append(Question.id > after_id)
+    return criteria
+
+
+def export_questions(criteria, batch_size=EXPORT_BATCH_SIZE):
+    """streams questions as NDJSON lines, ordered by id
+
+    yield_per reads the rows through a server-side cursor on Postgres, so
+    only one batch is held in memory however many rows are exported.
+
+    Keyword arguments:
+    criteria -- the filters returned by export_criteria
+    batch_size -- the number of rows fetched at a time
+    Return: a generator of NDJSON lines as bytes
+    """
+
+    encoder = current_encoder()
+    query = question_query().filter(*criteria).order_by(Question.id).yield_per(batch_size)
+    for row in query:
+        yield encoder.encode(dict(zip(QUESTION_FIELDS, row))) + b'\n'
@@ -0,0 +1,140 @@
+import csv
+import json
+
+from models import db, Question
+
+
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+# the number of row errors returned in a response, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+def decode_lines(stream):
+    """decodes a streamed request body line by line
+
+    Keyword arguments:
+    stream -- the raw request stream, read lazily
+    Return: a generator of text lines
+    """
+
+    for line in stream:
+        yield line.decode('utf-8')
+
+
+def iter_ndjson(lines):
+    """parses newline delimited JSON, one question object per line
+
+    Keyword arguments:
+    lines -- an iterable of text lines
+    Return: a generator of (line number, row, error) tuples
+    """
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'invalid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'expected a JSON object'
+        else:
+            yield line_number, row, None
+
+
+def iter_csv(lines):
+    """parses CSV with a header row naming the question fields
+
+    Keyword arguments:
+    lines -- an iterable of text lines
+    Return: a generator of (line number, row, error) tuples
+    """
+
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+def validate_question(row, categories):
+    """checks a parsed row and converts it to column values
+
+    Keyword arguments:
+    row -- a dict with the question, answer, category and difficulty
+    categories -- the {id: type} category map
+    Return: a tuple of the column values and an error message, one of them None
+    """
+
+    missing = [field for field in QUESTION_FIELDS if row.get(field) in (None, '')]
+    if missing:
+        return None, 'missing ' + ', '.join(missing)
+    if not isinstance(row['question'], str) or not isinstance(row['answer'], str):
+        return None, 'question and answer must be text'
+    try:
+        category = int(row['category'])
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError):
+        return None, 'category and difficulty must be integers'
+    if category not in categories:
+        return None, 'unknown category {}'.format(category)
+    if not 1 <= difficulty <= 5:
+        return None, 'difficulty must be between 1 and 5'
+    return {
+        'question': row['question'],
+        'answer': row['answer'],
+        'category': category,
+        'difficulty': difficulty
+    }, None
+
+
+def ingest_questions(rows, categories, batch_size):
+    """validates parsed rows and inserts them with one commit per batch
+
+    Keyword arguments:
+    rows -- an iterable of (line number, row, error) tuples
+    categories -- the {id: type} category map
+    batch_size -- the number of rows inserted per commit
+    Return: a tuple of the number of inserted rows, the number of failed rows
+    and the reported row errors
+    """
+
+    inserted = 0
+    failed = 0
+    errors = []
+    batch = []
+    batch_lines = []
+
+    def report(line_number, error):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line_number, 'error': error})
+
+    def flush():
+        try:
+            Question.insert_many(batch)
+            return len(batch)
+        except Exception:
+            db.session.rollback()
+            for line_number in batch_lines:
+                report(line_number, 'batch rejected by the database')
+            return 0
+
+    for line_number, row, error in rows:
+        values = None
+        if error is None:
+            values, error = validate_question(row, categories)
+        if error is not None:
+            failed += 1
+            report(line_number, error)
+            continue
+        batch.append(values)
+        batch_lines.append(line_number)
+        if len(batch) >= batch_size:
+            written = flush()
+            inserted += written
+            failed += len(batch) - written
+            batch, batch_lines = [], []
+    if batch:
+        written = flush()
+        inserted += written
+        failed += len(batch) - written
+    return inserted, failed, errors
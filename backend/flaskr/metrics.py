@@ -0,0 +1,222 @@
+import threading
+import time
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from db_pool import pool_stats
+from models import db
+
+
+# upper bounds of the histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+
+"""
+Histogram
+    a Prometheus style cumulative histogram, one per label set
+"""
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                name, format_labels(dict(labels, le=bound)), cumulative))
+        lines.append('{}_sum{} {}'.format(name, format_labels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, format_labels(labels), self.count))
+        return lines
+
+
+def format_labels(labels):
+    """formats a dict as Prometheus labels"""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + '}'
+
+
+"""
+MetricsRegistry
+    collects the per-request measurements of the api. Other modules can
+    register collectors, functions returning extra metric families as
+    (name, type, help, [(labels, value)]) tuples, which are rendered on
+    every scrape.
+"""
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+        self.collectors = []
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def count_request(self, labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def register_collector(self, collector):
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def render(self):
+        """returns all metrics in the Prometheus text exposition format"""
+        lines = ['# HELP trivia_requests_total Requests handled, by endpoint and status.',
+                 '# TYPE trivia_requests_total counter']
+        with self.lock:
+            for labels, value in sorted(self.requests.items()):
+                lines.append('trivia_requests_total{} {}'.format(format_labels(dict(labels)), value))
+            current = None
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name != current:
+                    current = name
+                    lines.append('# HELP {} {}'.format(name, HISTOGRAM_HELP[name]))
+                    lines.append('# TYPE {} histogram'.format(name))
+                lines.extend(histogram.render(name, dict(labels)))
+        for collector in self.collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                for labels, value in samples:
+                    lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+HISTOGRAM_HELP = {
+    'trivia_request_duration_seconds': 'Request latency, by endpoint.',
+    'trivia_request_sql_statements': 'SQL statements executed per request, by endpoint.',
+    'trivia_request_db_seconds': 'Time spent in the database per request, by endpoint.',
+    'trivia_request_rows_hydrated': 'ORM rows loaded per request, by endpoint.'
+}
+
+registry = MetricsRegistry()
+
+
+def tracking():
+    """tells whether the current context is an instrumented request"""
+    return has_app_context() and 'sql_statements' in g
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if tracking():
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if started and tracking():
+        g.db_time += time.perf_counter() - started.pop()
+        g.sql_statements += 1
+
+
+@event.listens_for(db.Model, 'load', propagate=True)
+def count_hydrated_row(target, context):
+    if tracking():
+        g.rows_hydrated += 1
+
+
+def pool_metrics():
+    """reports the connection pool statistics to the metrics registry"""
+    stats = pool_stats.stats()
+
+    def samples(key):
+        return [({'pool': name}, pool[key]) for name, pool in sorted(stats.items())
+                if pool.get(key) is not None]
+
+    return [
+        ('trivia_db_pool_checked_out', 'gauge',
+         'Connections currently checked out of the pool.', samples('checked_out')),
+        ('trivia_db_pool_size', 'gauge',
+         'Connections the pool keeps open, not counting overflow.', samples('size')),
+        ('trivia_db_pool_overflow', 'gauge',
+         'Overflow connections currently open beyond the pool size.', samples('overflow')),
+        ('trivia_db_pool_checkouts_total', 'counter',
+         'Connections handed out by the pool.', samples('checkouts')),
+        ('trivia_db_pool_wait_seconds_total', 'counter',
+         'Time spent waiting for a connection, including connecting.', samples('wait_seconds')),
+        ('trivia_db_pool_max_wait_seconds', 'gauge',
+         'Longest wait for a connection since the app started.', samples('max_wait_seconds')),
+        ('trivia_db_pool_overflow_total', 'counter',
+         'Checkouts that opened an overflow connection.', samples('overflows')),
+        ('trivia_db_pool_timeouts_total', 'counter',
+         'Checkouts that gave up after DB_POOL_TIMEOUT seconds.', samples('timeouts'))
+    ]
+
+
+def init_metrics(app):
+    """instruments the requests of an app and adds the /metrics route
+
+    Keyword arguments:
+    app -- the flask application
+    Return: the metrics registry
+    """
+
+    # collectors report the state of the latest app, like the module level caches
+    registry.collectors.clear()
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+        g.db_time = 0.0
+        g.rows_hydrated = 0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_started' not in g:
+            return response
+        duration = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        registry.count_request({'endpoint': endpoint, 'method': request.method,
+                                'status': response.status_code})
+        labels = {'endpoint': endpoint}
+        registry.observe('trivia_request_duration_seconds', labels, duration, LATENCY_BUCKETS)
+        registry.observe('trivia_request_sql_statements', labels, g.sql_statements, COUNT_BUCKETS)
+        registry.observe('trivia_request_db_seconds', labels, g.db_time, LATENCY_BUCKETS)
+        registry.observe('trivia_request_rows_hydrated', labels, g.rows_hydrated, COUNT_BUCKETS)
+        if app.config.get('SERVER_TIMING'):
+            response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries, {} rows", app;dur={:.2f}'.format(
+                g.db_time * 1000, g.sql_statements, g.rows_hydrated, duration * 1000))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """returns the api metrics in the Prometheus text format"""
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return registry
@@ -0,0 +1,62 @@
+from sqlalchemy import func
+
+from models import read_session
+
+
+def paginate_query(query, page, per_page):
+    """slices an ordered query with LIMIT/OFFSET inside the database
+
+    Keyword arguments:
+    query -- an ordered SQLAlchemy query
+    page -- the page number, starting from 1
+    per_page -- the number of rows on a page
+    Return: the rows on the requested page
+    """
+
+    if page < 1:
+        return []
+    return query.limit(per_page).offset((page - 1) * per_page).all()
+
+
+def keyset_query(query, column, after_id, per_page):
+    """returns the rows that come after a given key, so deep pages cost the same as the first
+
+    Keyword arguments:
+    query -- an unordered SQLAlchemy query
+    column -- the unique, indexed column the pages are ordered by
+    after_id -- the last key seen by the client
+    per_page -- the number of rows on a page
+    Return: the rows whose key is greater than after_id
+    """
+
+    return query.filter(column > after_id).order_by(column).limit(per_page).all()
+
+
+def paginate_request(request, query, column, per_page):
+    """paginates a query using the page or after_id argument of a request
+
+    Keyword arguments:
+    request -- used to read the page and after_id arguments
+    query -- an unordered SQLAlchemy query
+    column -- the unique, indexed column the pages are ordered by
+    per_page -- the number of rows on a page
+    Return: the rows on the requested page
+    """
+
+    after_id = request.args.get('after_id', type=int)
+    if after_id is not None:
+        return keyset_query(query, column, after_id, per_page)
+    page = request.args.get('page', 1, type=int)
+    return paginate_query(query.order_by(column), page, per_page)
+
+
+def count_rows(column, *criteria):
+    """counts rows with a single COUNT(*) instead of loading them
+
+    Keyword arguments:
+    column -- the column to count, usually the primary key
+    criteria -- optional filters applied before counting
+    Return: the number of matching rows
+    """
+
+    return read_session().query(func.count(column)).filter(*criteria).scalar()
@@ -0,0 +1,75 @@
+from models import read_session, Question
+from quiz_buckets import quiz_buckets
+from .serialization import question_query, rows_to_dicts
+
+
+def build_quiz_buckets():
+    """(re)builds the (category, difficulty) id buckets when they are missing or expired"""
+    if quiz_buckets.stale():
+        quiz_buckets.build(read_session().query(Question.id, Question.category, Question.difficulty))
+
+
+def sample_question(category_id, previous_questions, difficulties=None, mode='random',
+                    mix=None, ramp_every=2):
+    """picks one random question that was not asked before
+
+    The id is drawn from the in-memory (category, difficulty) buckets, so
+    the only query is the primary key lookup of the drawn question.
+
+    Keyword arguments:
+    category_id -- the id of the quiz category, 0 for all categories
+    previous_questions -- a list of question ids already asked
+    difficulties -- the difficulties allowed, None for all
+    mode -- 'random', 'ramp' or 'mix', see QuizBuckets.sample
+    mix -- {difficulty: weight} for the mix mode
+    ramp_every -- the questions asked per difficulty in the ramp mode
+    Return: a Question, or None once the category is exhausted
+    """
+
+    build_quiz_buckets()
+    excluded = list(previous_questions)
+    while True:
+        question_id = quiz_buckets.sample(category_id, excluded, difficulties, mode, mix, ramp_every)
+        if question_id is None:
+            return None
+        question = read_session().query(Question).filter(Question.id == question_id).first()
+        if question is not None:
+            return question
+        # deleted by another worker since the buckets were built
+        quiz_buckets.remove(question_id)
+        excluded.append(question_id)
+
+
+def sample_questions(category_id, previous_questions, count, stratify=False):
+    """picks up to count distinct random questions that were not asked before, in one query
+
+    The ids are drawn from the in-memory (category, difficulty) buckets and
+    the questions are read with a single IN query. When stratified, the ids
+    are drawn round-robin across the difficulties, so every difficulty is
+    represented before any repeats.
+
+    Keyword arguments:
+    category_id -- the id of the quiz category, 0 for all categories
+    previous_questions -- a list of question ids already asked
+    count -- the number of questions wanted
+    stratify -- spread the questions evenly over the difficulties
+    Return: a list of question dicts, empty once the category is exhausted
+    """
+
+    build_quiz_buckets()
+    excluded = list(previous_questions)
+    questions = []
+    while len(questions) < count:
+        ids = quiz_buckets.sample_many(category_id, excluded, count - len(questions), stratify)
+        if not ids:
+            break
+        by_id = {question['id']: question for question in rows_to_dicts(
+            question_query().filter(Question.id.in_(ids)))}
+        for question_id in ids:
+            if question_id in by_id:
+                questions.append(by_id[question_id])
+            else:
+                # deleted by another worker since the buckets were built
+                quiz_buckets.remove(question_id)
+        excluded.extend(ids)
+    return questions
@@ -0,0 +1,169 @@
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from random import shuffle
+
+from models import read_session, Question
+
+
+# serializes the deck cursor of sessions used by concurrent requests
+deck_lock = threading.Lock()
+
+
+"""
+QuizSession
+    a quiz played on the server. The question ids of the category are
+    shuffled once into a deck when the session starts, and a bitset with one
+    bit per deck position records the questions answered, so the client
+    never resends the questions it has seen. A skipped question has its bit
+    cleared and is served again once the rest of the deck was answered.
+"""
+
+
+class QuizSession:
+
+    def __init__(self, category_id, question_ids):
+        self.category_id = category_id
+        self.deck = array('l', question_ids)
+        shuffle(self.deck)
+        self.answered = bytearray((len(self.deck) + 7) // 8)
+        self.answered_count = 0
+        self.cursor = 0
+        self.current = None
+        self.touched_at = time.monotonic()
+
+    def is_answered(self, position):
+        return bool(self.answered[position >> 3] & (1 << (position & 7)))
+
+    def mark_answered(self, position):
+        if not self.is_answered(position):
+            self.answered[position >> 3] |= 1 << (position & 7)
+            self.answered_count += 1
+
+    def clear_answered(self, position):
+        if self.is_answered(position):
+            self.answered[position >> 3] &= ~(1 << (position & 7)) & 0xff
+            self.answered_count -= 1
+
+    def next_question_id(self, skip=False):
+        """takes the next unanswered question id from the deck, None when every one was answered
+
+        Keyword arguments:
+        skip -- put the question served last back, it comes again after the others
+        """
+
+        if skip and self.current is not None:
+            self.clear_answered(self.current)
+        self.current = None
+        size = len(self.deck)
+        if self.answered_count == size:
+            return None
+        # walks on from the cursor and wraps around to the skipped questions
+        position = self.cursor % size
+        while self.is_answered(position):
+            if position & 7 == 0 and self.answered[position >> 3] == 0xff:
+                position += 8
+            else:
+                position += 1
+            if position >= size:
+                position = 0
+        self.mark_answered(position)
+        self.current = position
+        self.cursor = position + 1
+        return self.deck[position]
+
+    @property
+    def remaining(self):
+        return len(self.deck) - self.answered_count
+
+
+"""
+MemoryQuizSessionStore
+    keeps quiz sessions in process memory. Sessions unused for ttl seconds
+    expire and the least recently used ones are dropped beyond max_sessions.
+    Any object with the same get/put/delete methods can be passed to
+    create_app as QUIZ_SESSION_STORE, e.g. one backed by a shared cache when
+    several worker processes serve the api. Sessions are changed in place by
+    every next question and then put back under their token, so a store
+    keeping serialized copies saves the new state.
+"""
+
+
+class MemoryQuizSessionStore:
+
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if self.ttl is not None and time.monotonic() - session.touched_at > self.ttl:
+                del self.sessions[token]
+                return None
+            session.touched_at = time.monotonic()
+            self.sessions.move_to_end(token)
+            return session
+
+    def put(self, token, session):
+        with self.lock:
+            self.sessions[token] = session
+            self.sessions.move_to_end(token)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def delete(self, token):
+        with self.lock:
+            return self.sessions.pop(token, None) is not None
+
+
+def start_session(store, category_id):
+    """creates a quiz session over the questions of a category
+
+    Keyword arguments:
+    store -- the quiz session store
+    category_id -- the id of the quiz category, 0 for all categories
+    Return: a tuple of the session token and the session
+    """
+
+    query = read_session().query(Question.id)
+    if category_id:
+        query = query.filter(Question.category == category_id)
+    session = QuizSession(category_id, [row[0] for row in query])
+    token = secrets.token_urlsafe(16)
+    store.put(token, session)
+    return token, session
+
+
+def next_session_question(store, token, session, skip=False):
+    """returns the next question of a session, skipping questions deleted since it started
+
+    The advanced session is put back into the store.
+
+    Keyword arguments:
+    store -- the quiz session store
+    token -- the session token
+    session -- the quiz session
+    skip -- put the question served last back into the deck
+    Return: a Question, or None once every question was answered
+    """
+
+    try:
+        while True:
+            with deck_lock:
+                question_id = session.next_question_id(skip)
+            skip = False
+            if question_id is None:
+                return None
+            question = read_session().query(Question).filter(
+                Question.id == question_id).one_or_none()
+            if question is not None:
+                return question
+    finally:
+        store.put(token, session)
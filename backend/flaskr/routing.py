@@ -0,0 +1,42 @@
+import time
+
+from flask import g, request
+
+from models import replica
+
+
+# the cookie holding the end of a client's read-your-writes window
+READ_YOUR_WRITES_COOKIE = 'trivia_rw'
+
+
+def init_routing(app):
+    """pins the reads of a client to the primary for a while after it wrote
+
+    The window travels in a cookie, so it holds whichever worker process
+    serves the next request of the client.
+
+    Keyword arguments:
+    app -- the flask application
+    """
+
+    @app.before_request
+    def pin_recent_writer():
+        until = request.cookies.get(READ_YOUR_WRITES_COOKIE, type=float)
+        if until is not None and until > time.time():
+            g.replica_pinned = True
+
+    @app.after_request
+    def remember_write(response):
+        if replica.engine is not None and g.get('replica_wrote'):
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, str(time.time() + replica.window),
+                                max_age=int(replica.window) + 1, httponly=True)
+        return response
+
+
+def replica_metrics():
+    """reports how the read-only queries were routed to the metrics registry"""
+    return [
+        ('trivia_read_routing_total', 'counter',
+         'Requests whose reads went to the replica, the primary, or the primary after a replica failure.',
+         [({'route': route}, count) for route, count in sorted(replica.routed.items())])
+    ]
@@ -0,0 +1,100 @@
+from sqlalchemy import func
+
+from models import db, read_session, Question, Category
+from search_index import text_index, tokenize
+from .pagination import paginate_query, count_rows
+from .serialization import QUESTION_FIELDS, question_query, rows_to_dicts
+
+
+def load_index_documents():
+    """reads the (kind, id, text) documents of the text index from the database"""
+    session = read_session()
+    documents = [('category', category_id, category_type) for category_id, category_type in
+                 session.query(Category.id, Category.type)]
+    documents.extend(('question', question_id, text) for question_id, text in
+                     session.query(Question.id, Question.question))
+    return documents
+
+
+def build_text_index():
+    """(re)builds the text index of searches and autocomplete when it is missing or expired"""
+    if text_index.stale():
+        text_index.build(load_index_documents())
+
+
+def prefix_tsquery(term):
+    """builds a to_tsquery text matching every token, the last one as a prefix
+
+    Keyword arguments:
+    term -- the word or phrase searched for
+    Return: the tsquery text, or None when the term has no word token
+    """
+
+    tokens = tokenize(term)
+    if not tokens:
+        return None
+    # the tokens are word characters only, quoting keeps them single lexemes
+    return ' & '.join(["'{}'".format(token) for token in tokens[:-1]] +
+                      ["'{}':*".format(tokens[-1])])
+
+
+def search_questions(term, page, per_page, fields=QUESTION_FIELDS):
+    """searches the question text and returns one ranked page of matches
+
+    Postgres uses the GIN full-text index on the question column, any other
+    database falls back to the in-process inverted index. Both match every
+    word of the term and the last one as a prefix, so partially typed words
+    still find results. Only a term without any usable word (punctuation,
+    or only stop words on Postgres) is searched as a substring of the
+    question, as the api always did: a substring search scans the table, so
+    terms that simply match nothing are not sent to it.
+
+    Keyword arguments:
+    term -- the word or phrase searched for
+    page -- the page number, starting from 1
+    per_page -- the number of questions on a page
+    fields -- the question columns to select, including id
+    Return: a tuple of the question dicts on the page and the total number of matches
+    """
+
+    text = prefix_tsquery(term)
+    if text is None:
+        return search_substring(term, page, per_page, fields)
+
+    if db.engine.dialect.name == 'postgresql':
+        vector = func.to_tsvector('english', Question.question)
+        query = func.to_tsquery('english', text)
+        matches = vector.op('@@')(query)
+        total = count_rows(Question.id, matches)
+        if total:
+            questions = paginate_query(question_query(fields).filter(matches).order_by(
+                func.ts_rank(vector, query).desc(), Question.id), page, per_page)
+            return rows_to_dicts(questions, fields), total
+        # a query left without lexemes (only stop words) matches nothing
+        if read_session().query(func.numnode(query)).scalar() == 0:
+            return search_substring(term, page, per_page, fields)
+        return [], 0
+
+    build_text_index()
+    ids = text_index.search(term)
+    page_ids = ids[(page - 1) * per_page:page * per_page] if page >= 1 else []
+    by_id = {question['id']: question for question in rows_to_dicts(
+        question_query(fields).filter(Question.id.in_(page_ids)), fields)} if page_ids else {}
+    return [by_id[question_id] for question_id in page_ids if question_id in by_id], len(ids)
+
+
+def search_substring(term, page, per_page, fields=QUESTION_FIELDS):
+    """returns one page of the questions containing the term, ordered by id
+
+    Keyword arguments:
+    term -- the text searched for
+    page -- the page number, starting from 1
+    per_page -- the number of questions on a page
+    fields -- the question columns to select, including id
+    Return: a tuple of the question dicts on the page and the total number of matches
+    """
+
+    matches = Question.question.ilike('%{}%'.format(term))
+    questions = paginate_query(question_query(fields).filter(matches).order_by(Question.id),
+                               page, per_page)
+    return rows_to_dicts(questions, fields), count_rows(Question.id, matches)
@@ -0,0 +1,149 @@
+import json
+
+from flask import current_app
+
+from models import read_session, Question
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is used without it
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2 has no JSON providers, jsonify keeps the stdlib encoder
+    DefaultJSONProvider = None
+
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+# the projection of list screens that only show the question text
+SUMMARY_FIELDS = ('id', 'question')
+
+
+def parse_fields(value):
+    """turns a fields argument into the question columns to select
+
+    Keyword arguments:
+    value -- comma separated column names, 'summary', or None for every column
+    Return: a tuple of column names in QUESTION_FIELDS order, always including id
+    Raises: ValueError for an unknown name
+    """
+
+    if not value:
+        return QUESTION_FIELDS
+    if not isinstance(value, str):
+        raise ValueError('fields must be a string')
+    names = {'id'}
+    for name in value.split(','):
+        name = name.strip()
+        if name == 'summary':
+            names.update(SUMMARY_FIELDS)
+        elif name in QUESTION_FIELDS:
+            names.add(name)
+        else:
+            raise ValueError('unknown field {}'.format(name))
+    return tuple(field for field in QUESTION_FIELDS if field in names)
+
+
+def question_query(fields=QUESTION_FIELDS):
+    """returns a query selecting only the given question columns as tuples
+
+    Keyword arguments:
+    fields -- the names of the question columns to select
+    Return: a SQLAlchemy query that does not hydrate Question objects
+    """
+
+    return read_session().query(*[getattr(Question, field) for field in fields])
+
+
+def rows_to_dicts(rows, fields=QUESTION_FIELDS):
+    """turns projected rows into the dicts sent to the client
+
+    Keyword arguments:
+    rows -- the tuples returned by a question_query
+    fields -- the names of the selected columns, in order
+    Return: a list of dicts
+    """
+
+    return [dict(zip(fields, row)) for row in rows]
+
+
+"""
+StdlibEncoder, OrjsonEncoder
+    encode a Python object straight to JSON bytes
+"""
+
+
+class StdlibEncoder:
+    name = 'json'
+
+    def encode(self, obj, sort_keys=False, default=None):
+        return json.dumps(obj, sort_keys=sort_keys, default=default,
+                          separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonEncoder:
+    name = 'orjson'
+
+    def encode(self, obj, sort_keys=False, default=None):
+        # category maps are keyed by integer ids
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+
+
+def get_encoder(name='auto'):
+    """returns the JSON encoder called name
+
+    Keyword arguments:
+    name -- 'orjson', 'json', or 'auto' for orjson when it is installed
+    Return: an encoder object
+    """
+
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_ENCODER is orjson but orjson is not installed')
+        return OrjsonEncoder()
+    if name == 'json':
+        return StdlibEncoder()
+    raise ValueError('unknown JSON_ENCODER {}'.format(name))
+
+
+if DefaultJSONProvider is not None:
+
+    class EncoderJSONProvider(DefaultJSONProvider):
+        """a JSON provider writing responses with the configured encoder"""
+
+        encoder = StdlibEncoder()
+
+        def response(self, *args, **kwargs):
+            if (self.compact is None and self._app.debug) or self.compact is False:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            body = self.encoder.encode(obj, sort_keys=self.sort_keys, default=self.default)
+            return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+
+def init_json(app):
+    """installs the encoder named by the JSON_ENCODER setting on an app
+
+    Keyword arguments:
+    app -- the flask application
+    Return: the encoder
+    """
+
+    encoder = get_encoder(app.config.get('JSON_ENCODER', 'auto'))
+    app.extensions['json_encoder'] = encoder
+    if DefaultJSONProvider is not None:
+        provider = EncoderJSONProvider(app)
+        provider.encoder = encoder
+        app.json = provider
+    return encoder
+
+
+def current_encoder():
+    """returns the encoder of the current app"""
+    return current_app.extensions['json_encoder']
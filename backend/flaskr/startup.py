@@ -0,0 +1,76 @@
+import threading
+import time
+
+import click
+
+from models import db
+from .categories import get_categories
+from .counts import category_question_counts
+from .quiz import build_quiz_buckets
+from .search import build_text_index
+
+
+def init_db_command(app):
+    """adds the flask init-db command creating the tables and indexes
+
+    Keyword arguments:
+    app -- the flask application
+    """
+
+    @app.cli.command('init-db')
+    def init_db():
+        """creates the missing tables and indexes of the database"""
+        started = time.perf_counter()
+        db.create_all()
+        click.echo('database ready in {:.3f}s'.format(time.perf_counter() - started))
+
+
+def warm_caches():
+    """loads the category map, the question counts, the text index and the quiz buckets
+
+    Return: the seconds it took
+    """
+
+    started = time.perf_counter()
+    get_categories()
+    category_question_counts()
+    build_text_index()
+    build_quiz_buckets()
+    return time.perf_counter() - started
+
+
+def start_warming(app):
+    """warms the caches of an app on a background thread
+
+    Requests arriving meanwhile load what they need themselves, so the app
+    serves from the start and gets faster once warming is done.
+
+    Keyword arguments:
+    app -- the flask application
+    Return: the thread
+    """
+
+    def warm():
+        try:
+            with app.app_context():
+                app.extensions['boot_timings']['warm'] = warm_caches()
+        except Exception:
+            app.logger.exception('warming the caches failed')
+
+    thread = threading.Thread(target=warm, name='trivia-warm', daemon=True)
+    thread.start()
+    return thread
+
+
+def boot_metrics_collector(app):
+    """returns a metrics collector reporting the boot timings of an app"""
+
+    def boot_metrics():
+        timings = app.extensions['boot_timings']
+        return [
+            ('trivia_boot_seconds', 'gauge',
+             'Seconds spent booting the worker, by phase.',
+             [({'phase': phase}, seconds) for phase, seconds in sorted(timings.items())])
+        ]
+
+    return boot_metrics
@@ -0,0 +1,18 @@
+from data_version import data_version
+from models import read_session, TableVersion
+
+
+def load_data_versions():
+    """reads the {table: version} map from the data_versions table"""
+    return dict(read_session().query(TableVersion.scope, TableVersion.version))
+
+
+def current_versions(fresh=False):
+    """returns the {table: version} map shared by every worker process
+
+    Keyword arguments:
+    fresh -- read the versions now, even if DATA_VERSION_TTL has not expired
+    Return: the {table: version} map
+    """
+
+    return data_version.refresh(load_data_versions, fresh)
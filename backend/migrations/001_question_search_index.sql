@@ -0,0 +1,11 @@
+--
+-- Full-text search index on questions.question
+--
+-- Databases created by setup_db get this index automatically. Run this file
+-- once against databases loaded from trivia.psql:
+--
+--     psql trivia < migrations/001_question_search_index.sql
+--
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_fts ON public.questions
+    USING GIN (to_tsvector('english', question));
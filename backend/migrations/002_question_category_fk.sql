@@ -0,0 +1,32 @@
+--
+-- Integer foreign key and indexes for questions.category and questions.difficulty
+--
+-- Databases created by setup_db already have this schema. Run this file once
+-- against databases loaded from trivia.psql, or created before the category
+-- column became an integer:
+--
+--     psql trivia < migrations/002_question_category_fk.sql
+--
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ALTER COLUMN category TYPE integer USING category::integer;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_catalog.pg_constraint
+        WHERE conrelid = 'public.questions'::regclass AND contype = 'f'
+    ) THEN
+        ALTER TABLE ONLY public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category) REFERENCES public.categories(id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON public.questions (category, id);
+CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON public.questions (difficulty);
+
+COMMIT;
@@ -0,0 +1,39 @@
+--
+-- Change counters of the questions and categories tables
+--
+-- Databases created by setup_db already have this table and its triggers.
+-- Run this file once against databases loaded from trivia.psql:
+--
+--     psql trivia < migrations/003_data_versions.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.data_versions (
+    scope character varying PRIMARY KEY,
+    version bigint NOT NULL
+);
+
+-- counters start from the creation time in milliseconds, so the versions
+-- of a recreated database do not repeat earlier ones
+INSERT INTO public.data_versions (scope, version) VALUES
+    ('questions', (extract(epoch FROM now()) * 1000)::bigint),
+    ('categories', (extract(epoch FROM now()) * 1000)::bigint)
+    ON CONFLICT (scope) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION trivia_bump_data_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE data_versions SET version = version + 1 WHERE scope = TG_ARGV[0];
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_data_version ON public.questions;
+CREATE TRIGGER questions_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON public.questions FOR EACH STATEMENT EXECUTE PROCEDURE trivia_bump_data_version('questions');
+
+DROP TRIGGER IF EXISTS categories_data_version ON public.categories;
+CREATE TRIGGER categories_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+    ON public.categories FOR EACH STATEMENT EXECUTE PROCEDURE trivia_bump_data_version('categories');
+
+COMMIT;
@@ -0,0 +1,52 @@
+--
+-- Per-category question counts maintained by the database
+--
+-- Databases created by setup_db already have this table and its triggers.
+-- Run this file once against databases loaded from trivia.psql:
+--
+--     psql trivia < migrations/004_question_counts.sql
+--
+
+BEGIN;
+
+-- no question is written while the counts are seeded
+LOCK TABLE public.questions IN SHARE MODE;
+
+CREATE TABLE IF NOT EXISTS public.question_counts (
+    category integer PRIMARY KEY,
+    total bigint NOT NULL
+);
+
+-- questions without a category are counted under category 0
+INSERT INTO public.question_counts (category, total)
+    SELECT COALESCE(category, 0), count(*) FROM public.questions
+    GROUP BY COALESCE(category, 0)
+    ON CONFLICT (category) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION trivia_count_questions() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM question_counts;
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        UPDATE question_counts SET total = total - 1
+            WHERE category = COALESCE(OLD.category, 0);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO question_counts (category, total) VALUES (COALESCE(NEW.category, 0), 1)
+            ON CONFLICT (category) DO UPDATE SET total = question_counts.total + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS questions_count ON public.questions;
+CREATE TRIGGER questions_count AFTER INSERT OR DELETE OR UPDATE OF category
+    ON public.questions FOR EACH ROW EXECUTE PROCEDURE trivia_count_questions();
+
+DROP TRIGGER IF EXISTS questions_count_truncate ON public.questions;
+CREATE TRIGGER questions_count_truncate AFTER TRUNCATE
+    ON public.questions FOR EACH STATEMENT EXECUTE PROCEDURE trivia_count_questions();
+
+COMMIT;
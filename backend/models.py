@@ -1,8 +1,19 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import time
+from flask import g, has_app_context
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Index, create_engine, event, DDL
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
 from flask_sqlalchemy import SQLAlchemy
 import json
 from dotenv import load_dotenv
+
+from db_pool import pool_options, pool_stats
+from data_version import data_version
+from quiz_buckets import quiz_buckets
+from response_cache import response_cache
+from search_index import text_index
 load_dotenv()
 
 
@@ -16,18 +27,123 @@ database_path = 'postgresql://{}:{}@{}/{}'.format(
 
 db = SQLAlchemy()
 
+"""
+ReplicaRouter
+    sends read-only queries to an optional replica database. Reads go to the
+    primary instead for window seconds after a write made by this process or
+    by the client (see flaskr.routing), and for retry seconds after the
+    replica could not be reached.
+"""
+
+
+class ReplicaRouter:
+
+    def __init__(self):
+        self.engine = None
+        self.session_factory = None
+        self.window = 5.0
+        self.retry = 5.0
+        self.last_write = None
+        self.unavailable_until = 0
+        self.routed = {'replica': 0, 'primary': 0, 'fallback': 0}
+        self.lock = threading.Lock()
+
+    def configure(self, replica_path, window=5.0, retry=5.0, **engine_options):
+        if self.engine is not None:
+            self.engine.dispose()
+        self.engine = None
+        self.session_factory = None
+        self.window = window
+        self.retry = retry
+        self.last_write = None
+        self.unavailable_until = 0
+        if replica_path:
+            engine_options.setdefault('pool_pre_ping', True)
+            self.engine = create_engine(replica_path, **engine_options)
+            self.session_factory = sessionmaker(bind=self.engine)
+
+    def mark_write(self):
+        """starts the read-your-writes window of this process and of the current client"""
+        with self.lock:
+            self.last_write = time.monotonic()
+        if has_app_context():
+            g.replica_wrote = True
+            # later reads of this request must see the write
+            self.close()
+
+    def session(self):
+        """returns the session read-only queries of the current context should use"""
+        if 'read_session' in g:
+            return g.read_session
+        session = db.session
+        route = 'primary'
+        if self.session_factory is not None and not self._pinned():
+            if time.monotonic() < self.unavailable_until:
+                route = 'fallback'
+            else:
+                replica_session = self.session_factory()
+                try:
+                    # checks out the connection the reads will use, pre-pinged by the pool
+                    replica_session.connection()
+                    session = replica_session
+                    route = 'replica'
+                except OperationalError:
+                    replica_session.close()
+                    self.unavailable_until = time.monotonic() + self.retry
+                    route = 'fallback'
+        with self.lock:
+            self.routed[route] += 1
+        g.read_session = session
+        return session
+
+    def close(self):
+        """closes the replica session of the current context"""
+        session = g.pop('read_session', None)
+        if session is not None and session is not db.session:
+            session.close()
+
+    def _pinned(self):
+        if g.get('replica_pinned') or g.get('replica_wrote'):
+            return True
+        last_write = self.last_write
+        return last_write is not None and time.monotonic() - last_write < self.window
+
+
+replica = ReplicaRouter()
+
+
+def read_session():
+    """returns the session for read-only queries, the replica when one is usable"""
+    return replica.session()
+
+
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, and an optional
+    read replica. The connection pools are configured by the DB_POOL*
+    settings (see db_pool.pool_options). Engines connect on first use, so
+    with create_all=False the database is not touched until a request
+    needs it.
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_path=None, create_all=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    pool_stats.clear()
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(
+        pool_options(app.config, database_path),
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if create_all:
+        with app.app_context():
+            db.create_all()
+    replica.configure(replica_path,
+                      window=app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5.0),
+                      retry=app.config.get('REPLICA_RETRY_SECONDS', 5.0),
+                      **pool_options(app.config, replica_path or '', 'replica'))
+    app.teardown_appcontext(lambda exception: replica.close())
 
 
 """
@@ -38,12 +154,15 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # serves category filtered listings in id order as an index range scan
+    __table_args__ = (Index('ix_questions_category_id', 'category', 'id'),)
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
-    difficulty = Column(Integer)
+    category = Column(Integer, ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
+    difficulty = Column(Integer, index=True)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -54,13 +173,41 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        replica.mark_write()
+        text_index.add('question', self.id, self.question)
+        quiz_buckets.add(self.id, self.category, self.difficulty)
+        response_cache.invalidate_category(self.category)
+        data_version.invalidate()
+
+    @staticmethod
+    def insert_many(rows):
+        """inserts a batch of question dicts with a single executemany and commit"""
+        db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+        replica.mark_write()
+        text_index.invalidate()
+        quiz_buckets.invalidate()
+        for category in {row['category'] for row in rows}:
+            response_cache.invalidate_category(category)
+        data_version.invalidate()
 
     def update(self):
         db.session.commit()
+        replica.mark_write()
+        text_index.add('question', self.id, self.question)
+        quiz_buckets.add(self.id, self.category, self.difficulty)
+        response_cache.clear()
+        data_version.invalidate()
 
     def delete(self):
+        category = self.category
         db.session.delete(self)
         db.session.commit()
+        replica.mark_write()
+        text_index.remove('question', self.id)
+        quiz_buckets.remove(self.id)
+        response_cache.invalidate_category(category)
+        data_version.invalidate()
 
     def format(self):
         return {
@@ -72,6 +219,14 @@ class Question(db.Model):
         }
 
 
+# on Postgres the question text is searched through a GIN full-text index,
+# which the database keeps up to date on every insert and delete
+event.listen(Question.__table__, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_fts ON questions "
+    "USING GIN (to_tsvector('english', question))"
+).execute_if(dialect='postgresql'))
+
+
 """
 Category
 
@@ -90,9 +245,128 @@ class Category(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        replica.mark_write()
+        text_index.add('category', self.id, self.type)
+        # lists spanning every category embed the category map
+        response_cache.invalidate_category(None)
+        data_version.invalidate()
 
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+TableVersion
+    one row per table ('questions', 'categories') counting the changes made
+    to it. Database triggers bump the row in the transaction of every insert,
+    update and delete, whichever worker process or client makes the change,
+    so every worker derives the same ETags and cache keys from it. The
+    counters start from the creation time in milliseconds, so the versions
+    of a recreated database do not repeat earlier ones.
+"""
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    scope = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+VERSIONED_TABLES = ('questions', 'categories')
+SEED_VERSIONS = ("INSERT INTO data_versions (scope, version) VALUES {} "
+                 "ON CONFLICT (scope) DO NOTHING")
+
+
+def version_ddl():
+    """returns the statements seeding data_versions and creating the triggers bumping it"""
+    statements = [
+        DDL(SEED_VERSIONS.format(', '.join(
+            "('{}', (extract(epoch FROM now()) * 1000)::bigint)".format(table)
+            for table in VERSIONED_TABLES))).execute_if(dialect='postgresql'),
+        DDL(SEED_VERSIONS.format(', '.join(
+            "('{}', CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))".format(table)
+            for table in VERSIONED_TABLES))).execute_if(dialect='sqlite'),
+        DDL("CREATE OR REPLACE FUNCTION trivia_bump_data_version() RETURNS trigger AS $$ "
+            "BEGIN "
+            "UPDATE data_versions SET version = version + 1 WHERE scope = TG_ARGV[0]; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql").execute_if(dialect='postgresql')
+    ]
+    for table in VERSIONED_TABLES:
+        statements.append(DDL(
+            "DROP TRIGGER IF EXISTS {0}_data_version ON {0}".format(table)
+        ).execute_if(dialect='postgresql'))
+        statements.append(DDL(
+            "CREATE TRIGGER {0}_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+            "ON {0} FOR EACH STATEMENT EXECUTE PROCEDURE trivia_bump_data_version('{0}')".format(table)
+        ).execute_if(dialect='postgresql'))
+        # SQLite only has row triggers
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(DDL(
+                "CREATE TRIGGER IF NOT EXISTS {0}_data_version_{1} AFTER {2} ON {0} BEGIN "
+                "UPDATE data_versions SET version = version + 1 WHERE scope = '{0}'; "
+                "END".format(table, operation.lower(), operation)
+            ).execute_if(dialect='sqlite'))
+    return statements
+
+
+"""
+QuestionCount
+    the number of questions of each category, under category 0 for questions
+    without one. Database triggers adjust the row of a category in the
+    transaction of every insert, delete and category update of a question,
+    whichever worker process or client makes the change.
+"""
+
+
+class QuestionCount(db.Model):
+    __tablename__ = 'question_counts'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    total = Column(BigInteger, nullable=False)
+
+
+ADD_QUESTION_COUNT = ("INSERT INTO question_counts (category, total) VALUES (COALESCE(NEW.category, 0), 1) "
+                      "ON CONFLICT (category) DO UPDATE SET total = question_counts.total + 1; ")
+REMOVE_QUESTION_COUNT = ("UPDATE question_counts SET total = total - 1 "
+                         "WHERE category = COALESCE(OLD.category, 0); ")
+
+
+def count_ddl():
+    """returns the statements seeding question_counts and creating the triggers maintaining it"""
+    return [
+        # only fills a new table, the triggers keep the counts from then on
+        DDL("INSERT INTO question_counts (category, total) "
+            "SELECT COALESCE(category, 0), count(*) FROM questions WHERE true "
+            "GROUP BY COALESCE(category, 0) ON CONFLICT (category) DO NOTHING"),
+        DDL("CREATE OR REPLACE FUNCTION trivia_count_questions() RETURNS trigger AS $$ "
+            "BEGIN "
+            "IF TG_OP = 'TRUNCATE' THEN DELETE FROM question_counts; RETURN NULL; END IF; "
+            "IF TG_OP <> 'INSERT' THEN " + REMOVE_QUESTION_COUNT + "END IF; "
+            "IF TG_OP <> 'DELETE' THEN " + ADD_QUESTION_COUNT + "END IF; "
+            "RETURN NULL; "
+            "END $$ LANGUAGE plpgsql").execute_if(dialect='postgresql'),
+        DDL("DROP TRIGGER IF EXISTS questions_count ON questions").execute_if(dialect='postgresql'),
+        DDL("CREATE TRIGGER questions_count AFTER INSERT OR DELETE OR UPDATE OF category "
+            "ON questions FOR EACH ROW EXECUTE PROCEDURE trivia_count_questions()"
+            ).execute_if(dialect='postgresql'),
+        DDL("DROP TRIGGER IF EXISTS questions_count_truncate ON questions").execute_if(dialect='postgresql'),
+        DDL("CREATE TRIGGER questions_count_truncate AFTER TRUNCATE "
+            "ON questions FOR EACH STATEMENT EXECUTE PROCEDURE trivia_count_questions()"
+            ).execute_if(dialect='postgresql'),
+        DDL("CREATE TRIGGER IF NOT EXISTS questions_count_insert AFTER INSERT ON questions BEGIN " +
+            ADD_QUESTION_COUNT + "END").execute_if(dialect='sqlite'),
+        DDL("CREATE TRIGGER IF NOT EXISTS questions_count_delete AFTER DELETE ON questions BEGIN " +
+            REMOVE_QUESTION_COUNT + "END").execute_if(dialect='sqlite'),
+        DDL("CREATE TRIGGER IF NOT EXISTS questions_count_update AFTER UPDATE OF category ON questions "
+            "BEGIN " + REMOVE_QUESTION_COUNT + ADD_QUESTION_COUNT + "END").execute_if(dialect='sqlite')
+    ]
+
+
+# the triggers are (re)created once every table exists
+for statement in version_ddl() + count_ddl():
+    event.listen(db.metadata, 'after_create', statement)
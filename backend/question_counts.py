@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+"""
+QuestionCounts
+    keeps the number of questions per category in memory, so totals are read
+    without a query. The counts are read from the question_counts table, which
+    database triggers maintain in the transaction of every insert, update and
+    delete of a question. The map is tagged with the version of the questions
+    table it was loaded at, and a read passing another version, because a
+    worker process changed the table since, reloads it. An optional ttl (in
+    seconds) also reloads it periodically.
+"""
+
+
+class QuestionCounts:
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.counts = None
+        self.loaded_version = None
+        self.loaded_at = 0
+        self.reconciliations = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """forces a reload on the next read"""
+        with self.lock:
+            self.counts = None
+
+    def by_category(self, loader, version):
+        """returns a copy of the {category: count} map
+
+        Keyword arguments:
+        loader -- a function returning the {category: count} map from the database
+        version -- the current version of the questions table, read before loading
+        Return: the {category: count} map
+        """
+
+        with self.lock:
+            if self._is_fresh(version):
+                return dict(self.counts)
+        counts = loader()
+        with self.lock:
+            self.counts = dict(counts)
+            self.loaded_version = version
+            self.loaded_at = time.monotonic()
+            self.reconciliations += 1
+        return counts
+
+    def total(self, loader, version):
+        """returns the number of questions in all categories"""
+        return sum(self.by_category(loader, version).values())
+
+    def for_category(self, category, loader, version):
+        """returns the number of questions in a category"""
+        return self.by_category(loader, version).get(category, 0)
+
+    def _is_fresh(self, version):
+        if self.counts is None or self.loaded_version != version:
+            return False
+        return self.ttl is None or time.monotonic() - self.loaded_at < self.ttl
+
+
+question_counts = QuestionCounts()
@@ -0,0 +1,232 @@
+import math
+import random
+import threading
+import time
+from array import array
+
+
+# random draws tried before the not yet asked questions are listed
+DRAW_ATTEMPTS = 8
+QUIZ_MODES = ('random', 'ramp', 'mix')
+
+
+def valid_mix(mix):
+    """tells whether {difficulty: weight} mix weights are usable by the mix mode
+
+    Every weight must be a finite number, not negative, and at least one positive.
+    """
+
+    weights = list(mix.values())
+    return all(0 <= weight < math.inf for weight in weights) and any(weight > 0 for weight in weights)
+
+
+"""
+QuizBuckets
+    keeps the question ids of every (category, difficulty) pair in compact
+    arrays, so a quiz question is drawn without querying the question
+    table. Question.insert / Question.delete add and remove single ids
+    (a removed id is swapped with the last one of its array), bulk changes
+    invalidate the buckets and the next draw rebuilds them. An optional ttl
+    (in seconds) also rebuilds them periodically, so changes made by other
+    worker processes are picked up.
+"""
+
+
+class QuizBuckets:
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.buckets = {}
+        self.positions = {}
+        self.built = False
+        self.built_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, rows):
+        """replaces the buckets with (id, category, difficulty) rows"""
+        with self.lock:
+            self.buckets = {}
+            self.positions = {}
+            for question_id, category, difficulty in rows:
+                self._add(question_id, category, difficulty)
+            self.built = True
+            self.built_at = time.monotonic()
+
+    def stale(self):
+        """tells whether the buckets have to be (re)built before a draw"""
+        return not self.built or (self.ttl is not None and
+                                  time.monotonic() - self.built_at > self.ttl)
+
+    def add(self, question_id, category, difficulty):
+        """files a question under its category and difficulty, ignored until built"""
+        with self.lock:
+            if self.built:
+                self._remove(question_id)
+                self._add(question_id, category, difficulty)
+
+    def remove(self, question_id):
+        """drops a question from its bucket"""
+        with self.lock:
+            self._remove(question_id)
+
+    def invalidate(self):
+        """forces a rebuild on the next draw, used after bulk changes"""
+        with self.lock:
+            self.built = False
+
+    def sample(self, category, previous_questions, difficulties=None, mode='random',
+               mix=None, ramp_every=2, rng=random):
+        """draws a question id that is not in previous_questions
+
+        random draws uniformly from the matching questions. ramp starts
+        with the easiest difficulty of the category and moves one
+        difficulty up every ramp_every questions. mix draws the difficulty
+        lagging furthest behind its share of the mix weights, so a quiz
+        follows the mix as closely as the remaining questions allow. When
+        the wanted difficulty is exhausted the nearest one is used.
+
+        Keyword arguments:
+        category -- the category id, 0 or None for all categories
+        previous_questions -- the ids already asked
+        difficulties -- the difficulties allowed, None for all
+        mode -- 'random', 'ramp' or 'mix'
+        mix -- {difficulty: weight} for the mix mode
+        ramp_every -- the questions asked per difficulty in the ramp mode
+        rng -- the random number generator
+        Return: a question id, or None once every matching question was asked
+        """
+
+        excluded = set(previous_questions)
+        with self.lock:
+            levels = {}
+            for key, bucket in self.buckets.items():
+                if bucket and (not category or key[0] == category) and \
+                        (difficulties is None or key[1] in difficulties):
+                    levels.setdefault(key[1], []).append(key)
+            if not levels:
+                return None
+            if mode == 'ramp':
+                groups = self._ramp_groups(levels, len(excluded), ramp_every)
+            elif mode == 'mix':
+                groups = self._mix_groups(levels, excluded, mix or {})
+            else:
+                groups = [[key for keys in levels.values() for key in keys]]
+            for keys in groups:
+                question_id = self._draw(keys, excluded, rng)
+                if question_id is not None:
+                    return question_id
+            return None
+
+    def sample_many(self, category, previous_questions, count, stratify=False, rng=random):
+        """draws up to count distinct question ids that are not in previous_questions
+
+        Stratified draws go round-robin over the difficulties of the
+        category, easiest first, so every difficulty is represented before
+        any repeats.
+
+        Keyword arguments:
+        category -- the category id, 0 or None for all categories
+        previous_questions -- the ids already asked
+        count -- the number of ids wanted
+        stratify -- spread the ids evenly over the difficulties
+        rng -- the random number generator
+        Return: a list of question ids, shorter than count when the category runs out
+        """
+
+        excluded = set(previous_questions)
+        drawn = []
+        with self.lock:
+            levels = {}
+            for key, bucket in self.buckets.items():
+                if bucket and (not category or key[0] == category):
+                    levels.setdefault(key[1], []).append(key)
+            if stratify:
+                groups = [levels[difficulty] for difficulty in sorted(
+                    levels, key=lambda difficulty: (difficulty is None, difficulty or 0))]
+            else:
+                groups = [[key for keys in levels.values() for key in keys]]
+            while groups and len(drawn) < count:
+                for keys in list(groups):
+                    question_id = self._draw(keys, excluded, rng)
+                    if question_id is None:
+                        groups.remove(keys)
+                        continue
+                    excluded.add(question_id)
+                    drawn.append(question_id)
+                    if len(drawn) == count:
+                        break
+        return drawn
+
+    def _ramp_groups(self, levels, asked, ramp_every):
+        # questions without a difficulty come last
+        ordered = sorted(levels, key=lambda difficulty: (difficulty is None, difficulty or 0))
+        target = min(asked // max(ramp_every, 1), len(ordered) - 1)
+        # the nearest difficulties next, the harder one first on a tie
+        order = sorted(range(len(ordered)), key=lambda i: (abs(i - target), i < target))
+        return [levels[ordered[i]] for i in order]
+
+    def _mix_groups(self, levels, excluded, mix):
+        weights = {difficulty: weight for difficulty, weight in mix.items()
+                   if weight > 0 and difficulty in levels}
+        wanted = []
+        if weights:
+            asked = {}
+            for question_id in excluded:
+                position = self.positions.get(question_id)
+                if position is not None:
+                    asked[position[0][1]] = asked.get(position[0][1], 0) + 1
+            total_weight = sum(weights.values())
+            total_asked = sum(asked.get(difficulty, 0) for difficulty in weights) + 1
+            deficit = {difficulty: weight / total_weight * total_asked - asked.get(difficulty, 0)
+                       for difficulty, weight in weights.items()}
+            wanted = sorted(weights, key=lambda difficulty: (-deficit[difficulty], difficulty))
+            target = wanted[0]
+        else:
+            target = max(mix, key=lambda difficulty: (mix[difficulty], -difficulty)) if mix else 0
+        # the other difficulties next, the nearest first and the harder one on a tie,
+        # questions without a difficulty last
+        others = sorted([difficulty for difficulty in levels if difficulty not in weights],
+                        key=lambda difficulty: (difficulty is None, abs((difficulty or 0) - target),
+                                                (difficulty or 0) < target))
+        return [levels[difficulty] for difficulty in wanted + others]
+
+    def _draw(self, keys, excluded, rng):
+        total = sum(len(self.buckets[key]) for key in keys)
+        if total == 0:
+            return None
+        for _ in range(DRAW_ATTEMPTS):
+            position = rng.randrange(total)
+            for key in keys:
+                bucket = self.buckets[key]
+                if position < len(bucket):
+                    question_id = bucket[position]
+                    break
+                position -= len(bucket)
+            if question_id not in excluded:
+                return question_id
+        # most of these questions were asked already
+        remaining = [question_id for key in keys for question_id in self.buckets[key]
+                     if question_id not in excluded]
+        return rng.choice(remaining) if remaining else None
+
+    def _add(self, question_id, category, difficulty):
+        key = (category, difficulty)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = array('q')
+        self.positions[question_id] = (key, len(bucket))
+        bucket.append(question_id)
+
+    def _remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        key, index = position
+        bucket = self.buckets[key]
+        last = bucket.pop()
+        if last != question_id:
+            bucket[index] = last
+            self.positions[last] = (key, index)
+
+
+quiz_buckets = QuizBuckets()
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+"""
+ResponseCache
+    a bounded LRU cache of encoded list responses, keyed by
+    (endpoint, category, page, fields, versions). Entries of a category are
+    dropped when a question of that category is created or deleted, entries
+    without a category (lists spanning every category) on any change. A
+    generation counter per category keeps a response computed before an
+    invalidation from being stored after it. Changes made by other worker
+    processes move the versions part of the keys, the entries of older
+    versions are left to the LRU eviction. An optional ttl (in seconds)
+    bounds the age of an entry.
+"""
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.by_category = {}
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """returns the cached value of a key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    time.monotonic() - entry[1] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, category):
+        """returns the invalidation generation of a category, taken before computing a value"""
+        with self.lock:
+            return self.generations.get(category, 0), self.generations.get(None, 0)
+
+    def put(self, key, value, generation):
+        """stores a value unless its category was invalidated since generation was taken"""
+        category = key[1]
+        with self.lock:
+            if self.max_entries <= 0 or generation != (
+                    self.generations.get(category, 0), self.generations.get(None, 0)):
+                return
+            self._drop(key)
+            self.entries[key] = (value, time.monotonic())
+            self.by_category.setdefault(category, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_category(self, category):
+        """drops the entries of a category and the entries spanning every category"""
+        with self.lock:
+            for scope in {category, None}:
+                self.generations[scope] = self.generations.get(scope, 0) + 1
+                for key in list(self.by_category.get(scope, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """drops every entry"""
+        with self.lock:
+            # every stored generation includes the one of the None scope
+            self.generations[None] = self.generations.get(None, 0) + 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.by_category.clear()
+
+    def stats(self):
+        """returns the cache statistics as a dict"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _drop(self, key):
+        if self.entries.pop(key, None) is not None:
+            keys = self.by_category.get(key[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_category[key[1]]
+
+
+response_cache = ResponseCache()
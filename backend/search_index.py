@@ -0,0 +1,194 @@
+import heapq
+import itertools
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """splits a text into lower case word tokens
+
+    Keyword arguments:
+    text -- the text to split
+    Return: a list of tokens
+    """
+
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+def rank(kind, doc_id, text):
+    """orders categories before questions, then shorter texts first"""
+    return (kind != 'category', len(text), doc_id)
+
+
+"""
+InvertedIndex
+    an in-process index over short texts, the question text and the
+    category names, documents being keyed by (kind, id). It serves the
+    full-text search when the database has none (e.g. SQLite) and the
+    typeahead on every database. The distinct tokens are kept in a sorted
+    array, so the tokens starting with a prefix are a contiguous slice found
+    by binary search, and the documents of every token are kept in rank
+    order, so the best k completions are the first k of a lazy merge of
+    those lists. It is built lazily on the first lookup and kept up to date
+    by Question.insert, Question.delete and Category.insert, bulk changes
+    invalidate it. An optional ttl (in seconds) also rebuilds it
+    periodically, so changes made by other worker processes are picked up.
+"""
+
+
+class InvertedIndex:
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.tokens = []
+        self.postings = {}
+        self.documents = {}
+        self.built = False
+        self.built_at = 0
+        self.lock = threading.Lock()
+
+    def build(self, documents):
+        """replaces the index content with (kind, id, text) documents"""
+        with self.lock:
+            self.postings = {}
+            self.documents = {}
+            for kind, doc_id, text in documents:
+                key = (kind, doc_id)
+                self.documents[key] = (text or '', Counter(tokenize(text)))
+                for token in self.documents[key][1]:
+                    self.postings.setdefault(token, []).append((rank(kind, doc_id, text or ''), key))
+            for postings in self.postings.values():
+                postings.sort()
+            self.tokens = sorted(self.postings)
+            self.built = True
+            self.built_at = time.monotonic()
+
+    def stale(self):
+        """tells whether the index has to be (re)built before a lookup"""
+        return not self.built or (self.ttl is not None and
+                                  time.monotonic() - self.built_at > self.ttl)
+
+    def add(self, kind, doc_id, text):
+        """indexes a single document, ignored until the index is built"""
+        with self.lock:
+            if not self.built:
+                return
+            key = (kind, doc_id)
+            self._remove(key)
+            text = text or ''
+            self.documents[key] = (text, Counter(tokenize(text)))
+            for token in self.documents[key][1]:
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = []
+                    insort(self.tokens, token)
+                insort(postings, (rank(kind, doc_id, text), key))
+
+    def remove(self, kind, doc_id):
+        """drops a single document from the index"""
+        with self.lock:
+            self._remove((kind, doc_id))
+
+    def invalidate(self):
+        """forces a rebuild on the next lookup, used after bulk changes"""
+        with self.lock:
+            self.built = False
+
+    def search(self, term, kind='question'):
+        """finds the documents of a kind containing every token of the term
+
+        The last token also matches as a prefix, so partially typed words
+        still find results. Documents are scored by how often the tokens
+        occur in them.
+
+        Keyword arguments:
+        term -- the word or phrase searched for
+        kind -- the kind of documents searched
+        Return: a list of document ids, best matches first
+        """
+
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+        with self.lock:
+            scores = None
+            for position, token in enumerate(tokens):
+                if position == len(tokens) - 1:
+                    matched = self._prefixed(token)
+                else:
+                    matched = [token] if token in self.postings else []
+                token_scores = {}
+                for key in matched:
+                    for _, (doc_kind, doc_id) in self.postings[key]:
+                        if doc_kind == kind:
+                            token_scores[doc_id] = token_scores.get(doc_id, 0) + \
+                                self.documents[(doc_kind, doc_id)][1][key]
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: score + token_scores[doc_id]
+                              for doc_id, score in scores.items() if doc_id in token_scores}
+                if not scores:
+                    return []
+        return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+    def complete(self, text, limit=10):
+        """returns the documents matching a partially typed text
+
+        Every token but the last must match a word of the document, the
+        last token matches as a prefix. Documents having the last token as
+        a whole word come first, then categories before questions, then
+        shorter texts.
+
+        Keyword arguments:
+        text -- what the user typed so far
+        limit -- the maximum number of documents returned
+        Return: a list of (kind, id, text) tuples, best matches first
+        """
+
+        tokens = tokenize(text)
+        if not tokens or limit <= 0:
+            return []
+        prefix, required = tokens[-1], set(tokens[:-1])
+        with self.lock:
+            if any(token not in self.postings for token in required):
+                return []
+            exact = self.postings.get(prefix, [])
+            others = heapq.merge(*[self.postings[token] for token in self._prefixed(prefix)
+                                   if token != prefix])
+            found = []
+            seen = set()
+            for _, key in itertools.chain(exact, others):
+                if key in seen or not required.issubset(self.documents[key][1]):
+                    continue
+                seen.add(key)
+                found.append((key[0], key[1], self.documents[key][0]))
+                if len(found) == limit:
+                    break
+            return found
+
+    def _prefixed(self, prefix):
+        start = bisect_left(self.tokens, prefix)
+        return self.tokens[start:bisect_left(self.tokens, prefix + '\uffff', start)]
+
+    def _remove(self, key):
+        document = self.documents.pop(key, None)
+        if document is None:
+            return
+        text, tokens = document
+        entry = (rank(key[0], key[1], text), key)
+        for token in tokens:
+            postings = self.postings[token]
+            del postings[bisect_left(postings, entry)]
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+
+text_index = InvertedIndex()
@@ -1,10 +1,17 @@
 import os
+import copy
+import tempfile
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import gzip
+import threading
+import time
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.quiz_sessions import MemoryQuizSessionStore
+from sqlalchemy import create_engine, func
+
+from models import db, replica, Question, Category
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -18,12 +25,13 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgresql://{}:{}@{}/{}".format(
             username, password, 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+        # the schema comes from trivia.psql and the migrations, so it is not created per test
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                               'LAZY_STARTUP': True})
+        self.client = self.app.test_client
 
         # declared variables to be used as parameters
         self.searchTerm = 'Tom Hanks'
@@ -34,13 +42,6 @@ class TriviaTestCase(unittest.TestCase):
         self.random_question = {'previous_questions': [],
                                 'quiz_category': {'type': 'Science', 'id': '1'}}
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after reach test"""
         pass
@@ -54,6 +55,43 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(data['total_questions'])
 
+    def test_get_paginated_questions_summary(self):
+        res = self.client().get('/api/questions?fields=summary')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+
+    def test_get_paginated_questions_unknown_field(self):
+        res = self.client().get('/api/questions?fields=secret')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_get_paginated_questions_gzip(self):
+        res = self.client().get('/api/questions', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'])
+
+    def test_get_paginated_questions_gzip_etag(self):
+        plain = self.client().get('/api/questions')
+        res = self.client().get('/api/questions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+
+        res = self.client().get('/api/questions', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertTrue(res.headers['ETag'].endswith('-gzip"'))
+
     def test_out_of_range_page_number(self):
         res = self.client().get('/api/questions?page=100')
         data = json.loads(res.data)
@@ -62,6 +100,57 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Not Processable')
 
+    def test_get_questions_after_id(self):
+        res = self.client().get('/api/questions?after_id=10')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(all(question['id'] > 10 for question in data['questions']))
+        self.assertEqual(data['next_after_id'], data['questions'][-1]['id'])
+
+    def test_out_of_range_after_id(self):
+        res = self.client().get('/api/questions?after_id=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Not Processable')
+
+    def test_export_questions(self):
+        res = self.client().get('/api/questions/export?category=2&after_id=16')
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(rows)
+        self.assertTrue(all(row['id'] > 16 for row in rows))
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+
+    def test_get_metrics(self):
+        self.client().get('/api/categories')
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="get_all_categories"}', body)
+        self.assertIn('trivia_request_sql_statements_bucket', body)
+
+    def test_init_db_command(self):
+        result = self.app.test_cli_runner().invoke(args=['init-db'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('database ready', result.output)
+        self.assertIn('setup_db', self.app.extensions['boot_timings'])
+
+    def test_import_time_reported(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'LAZY_STARTUP': True,
+                          'IMPORT_SECONDS': 0.25})
+        body = app.test_client().get('/metrics').data.decode()
+
+        self.assertEqual(app.extensions['boot_timings']['import'], 0.25)
+        self.assertIn('trivia_boot_seconds{phase="import"} 0.25', body)
+
     def test_get_all_categories(self):
         res = self.client().get('/api/categories')
         data = json.loads(res.data)
@@ -70,6 +159,62 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['categories'])
 
+    def test_get_all_categories_with_counts(self):
+        res = self.client().get('/api/categories?counts=true')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(set(data['category_counts']), set(data['categories']))
+        self.assertTrue(data['category_counts']['2'])
+
+    def test_get_all_categories_not_modified(self):
+        res = self.client().get('/api/categories')
+        etag = res.headers['ETag']
+        res = self.client().get('/api/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_get_paginated_questions_modified(self):
+        etag = self.client().get('/api/questions').headers['ETag']
+        self.client().post('/api/questions/new-question', json=self.new_question)
+        res = self.client().get('/api/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_get_category_questions_changed_elsewhere(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'LAZY_STARTUP': True,
+                          'DATA_VERSION_TTL': 0})
+        client = app.test_client()
+        etag = client.get('/api/categories/2/questions').headers['ETag']
+        # changed without the models, as another worker process would appear to this one
+        with app.app_context():
+            db.session.execute(Question.__table__.insert().values(
+                question='changed elsewhere', answer='yes', category=2, difficulty=1))
+            db.session.commit()
+        res = client.get('/api/categories/2/questions', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIn('changed elsewhere', [q['question'] for q in data['questions']])
+
+    def test_total_questions_changed_elsewhere(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'LAZY_STARTUP': True,
+                          'DATA_VERSION_TTL': 0})
+        client = app.test_client()
+        total = json.loads(client.get('/api/questions').data)['total_questions']
+        # deleted without the models, as another worker process would appear to this one
+        with app.app_context():
+            question_id = db.session.query(func.max(Question.id)).scalar()
+            db.session.execute(Question.__table__.delete().where(Question.id == question_id))
+            db.session.commit()
+        data = json.loads(client.get('/api/questions').data)
+
+        self.assertEqual(data['total_questions'], total - 1)
+
     def test_get_categories_not_allowed(self):
         res = self.client().post('/api/categories')
         data = json.loads(res.data)
@@ -87,6 +232,22 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['questions'])
         self.assertTrue(data['totalQuestions'])
 
+    def test_get_page_of_questions_per_category_selected(self):
+        res = self.client().get('/api/categories/2/questions?page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'])
+        self.assertLessEqual(len(data['questions']), 10)
+
+    def test_questions_per_category_cache_invalidated(self):
+        before = json.loads(self.client().get('/api/categories/3/questions').data)
+        self.client().post('/api/questions/new-question', json=self.new_question)
+        after = json.loads(self.client().get('/api/categories/3/questions').data)
+
+        self.assertEqual(after['totalQuestions'], before['totalQuestions'] + 1)
+
     def test_get_all_questions_per_category_selected_not_found(self):
         res = self.client().get('/api/categories/20/questions')
         data = json.loads(res.data)
@@ -111,6 +272,27 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Not Processable')
 
+    def test_bulk_import_questions(self):
+        body = '\n'.join(json.dumps(question) for question in [
+            self.new_question, dict(self.new_question, category=1000)])
+        res = self.client().post('/api/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['errors'][0]['line'], 2)
+        self.assertTrue(data['total_questions'])
+
+    def test_bulk_import_questions_unsupported_type(self):
+        res = self.client().post('/api/questions/bulk', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_delete_question(self):
         res = self.client().delete(f'/api/questions/{self.delete_id}')
         data = json.loads(res.data)
@@ -153,6 +335,37 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertEqual(len(data['questions']), 1)
 
+    def test_for_question_search_partial_word(self):
+        res = self.client().post('/api/questions/search', json={'searchTerm': 'Tom Hank'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 1)
+
+    def test_for_question_search_stop_words(self):
+        res = self.client().post('/api/questions/search', json={'searchTerm': 'the'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['total_questions'])
+
+    def test_for_question_search_fields(self):
+        res = self.client().post('/api/questions/search',
+                                 json={'searchTerm': self.searchTerm, 'fields': 'answer'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['questions'][0]), {'id', 'answer'})
+
+    def test_for_question_search_out_of_range_page(self):
+        res = self.client().post(
+            '/api/questions/search', json={'searchTerm': f'{self.searchTerm}', 'page': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_for_question_search_without_results(self):
         res = self.client().post('/api/questions/search',
                                  json={'search': 'zebra'})
@@ -162,6 +375,31 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def test_for_question_search_miss_not_searched_as_substring(self):
+        # 'anks' is inside 'Hanks' but starts no word
+        res = self.client().post('/api/questions/search', json={'searchTerm': 'anks'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def test_autocomplete(self):
+        res = self.client().get('/api/autocomplete?q=scie')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['suggestions'][0]['type'], 'category')
+        self.assertEqual(data['suggestions'][0]['text'], 'Science')
+
+    def test_autocomplete_without_text(self):
+        res = self.client().get('/api/autocomplete')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def test_get_single_random_question(self):
         res = self.client().post('/api/quizzes', json=self.random_question)
         data = json.loads(res.data)
@@ -170,6 +408,169 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question'])
 
+    def test_get_single_random_question_category_exhausted(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [16, 17, 18, 19],
+            'quiz_category': {'type': 'Art', 'id': 2}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['question'], False)
+
+    def test_get_single_random_question_unknown_category(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'Unknown', 'id': 1000}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_get_ramped_random_question(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': '1'},
+            'mode': 'ramp'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['category'], 1)
+
+    def test_get_mixed_random_question_falls_back(self):
+        # question 16 is the only Art question of difficulty 1
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [16], 'quiz_category': {'type': 'Art', 'id': '2'},
+            'mode': 'mix', 'mix': {'1': 1}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['category'], 2)
+
+    def test_get_mixed_random_question_negative_weight(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': '1'},
+            'mode': 'mix', 'mix': {'1': -1}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_get_mixed_random_question_without_positive_weight(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': '1'},
+            'mode': 'mix', 'mix': {'1': 0, '5': 0}})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_random_question_unknown_mode(self):
+        res = self.client().post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'type': 'Science', 'id': '1'},
+            'mode': 'hardest'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_get_random_question_batch(self):
+        res = self.client().post('/api/quizzes/batch', json={
+            'previous_questions': [20], 'quiz_category': {'type': 'Science', 'id': 1},
+            'count': 5, 'stratify': True})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(ids)
+        self.assertNotIn(20, ids)
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_get_random_question_batch_malformed(self):
+        for body in ({'quiz_category': 'Science'},
+                     {'quiz_category': {'id': 1}, 'previous_questions': 5}):
+            res = self.client().post('/api/quizzes/batch', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['message'], 'bad request')
+
+    def test_get_random_question_batch_too_large(self):
+        res = self.client().post('/api/quizzes/batch', json=dict(self.random_question, count=1000))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_quiz_session(self):
+        res = self.client().post('/api/quizzes/sessions', json=self.random_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['token'])
+        self.assertTrue(data['total_questions'])
+
+        seen = []
+        for _ in range(data['total_questions']):
+            res = self.client().post(f"/api/quizzes/sessions/{data['token']}/next")
+            question = json.loads(res.data)['question']
+            if question:
+                seen.append(question['id'])
+        self.assertEqual(len(seen), len(set(seen)))
+
+        res = self.client().post(f"/api/quizzes/sessions/{data['token']}/next")
+        self.assertEqual(json.loads(res.data)['question'], False)
+
+    def test_quiz_session_skip(self):
+        res = self.client().post('/api/quizzes/sessions', json=self.random_question)
+        token = json.loads(res.data)['token']
+
+        res = self.client().post(f'/api/quizzes/sessions/{token}/next')
+        first = json.loads(res.data)
+        res = self.client().post(f'/api/quizzes/sessions/{token}/next', json={'skip': True})
+        data = json.loads(res.data)
+
+        # the skipped question is still to be answered
+        self.assertEqual(data['remaining'], first['remaining'])
+        seen = [data['question']['id']] if data['question'] else []
+        while True:
+            res = self.client().post(f'/api/quizzes/sessions/{token}/next')
+            question = json.loads(res.data)['question']
+            if not question:
+                break
+            seen.append(question['id'])
+        self.assertIn(first['question']['id'], seen)
+
+    def test_quiz_session_saved_to_store(self):
+        class CopyingStore(MemoryQuizSessionStore):
+            def get(self, token):
+                session = super().get(token)
+                return copy.deepcopy(session) if session is not None else None
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'LAZY_STARTUP': True,
+                          'QUIZ_SESSION_STORE': CopyingStore()})
+        client = app.test_client()
+        res = client.post('/api/quizzes/sessions', json=self.random_question)
+        data = json.loads(res.data)
+
+        seen = []
+        for _ in range(data['total_questions']):
+            res = client.post(f"/api/quizzes/sessions/{data['token']}/next")
+            seen.append(json.loads(res.data)['question']['id'])
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_quiz_session_unknown_token(self):
+        res = self.client().post('/api/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
     def test_get_single_random_question_without_quiz_category(self):
         res = self.client().post(
             '/api/quizzes', json={'previous_questions': []})
@@ -179,6 +580,131 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'bad request')
 
+    def sqlite_databases(self, directory, *names):
+        """creates SQLite databases holding a single category named after the database"""
+        paths = {}
+        for name in names:
+            paths[name] = 'sqlite:///' + os.path.join(directory, name + '.db')
+            engine = create_engine(paths[name])
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(Category.__table__.insert().values(id=1, type=name))
+            engine.dispose()
+        return paths
+
+    def test_reads_routed_to_replica_until_a_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.sqlite_databases(directory, 'primary', 'replica')
+            app = create_app({'SQLALCHEMY_DATABASE_URI': paths['primary'],
+                              'SQLALCHEMY_REPLICA_URI': paths['replica'], 'LAZY_STARTUP': True})
+            client = app.test_client()
+            res = client.get('/api/categories')
+
+            self.assertEqual(json.loads(res.data)['categories'], {'1': 'replica'})
+
+            res = client.post('/api/categories/new-category', json={'category': 'Culture'})
+
+            self.assertIn('trivia_rw=', res.headers.get('Set-Cookie'))
+
+            # the write made the category map stale, it is reloaded from the primary
+            res = client.get('/api/categories')
+
+            self.assertEqual(json.loads(res.data)['categories'], {'1': 'primary', '2': 'Culture'})
+            replica.configure(None)
+
+    def test_reads_fall_back_to_primary_without_replica(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = self.sqlite_databases(directory, 'primary')
+            app = create_app({'SQLALCHEMY_DATABASE_URI': paths['primary'],
+                              'SQLALCHEMY_REPLICA_URI': 'sqlite:///' + os.path.join(
+                                  directory, 'missing', 'replica.db'),
+                              'LAZY_STARTUP': True})
+            fallbacks = replica.routed['fallback']
+            res = app.test_client().get('/api/categories')
+
+            self.assertEqual(json.loads(res.data)['categories'], {'1': 'primary'})
+            self.assertEqual(replica.routed['fallback'], fallbacks + 1)
+            replica.configure(None)
+
+    def test_metrics_report_pool_statistics(self):
+        self.client().get('/api/questions')
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_db_pool_checkouts_total{pool="primary"}', body)
+        self.assertIn('trivia_db_pool_checked_out{pool="primary"}', body)
+
+    def test_search_shed_when_saturated(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'ADMISSION_LIMITS': {'get_question_by_search': {'concurrency': 0}}})
+        res = app.test_client().post('/api/questions/search', json={'searchTerm': self.searchTerm})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Service Unavailable')
+        self.assertTrue(res.headers.get('Retry-After'))
+
+    def test_search_queued_then_shed_on_timeout(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'LAZY_STARTUP': True,
+                          'ADMISSION_LIMITS': {'get_question_by_search': {
+                              'concurrency': 1, 'queue': 2, 'timeout': 1.0}}})
+        # every admitted request holds its slot until its own event is set
+        events = [threading.Event(), threading.Event()]
+        admitted = []
+
+        def blocking_search():
+            position = len(admitted)
+            admitted.append(position)
+            events[position].wait(5)
+            return json.dumps({'success': True})
+
+        app.view_functions['get_question_by_search'] = blocking_search
+        statuses = {}
+
+        def search(name):
+            res = app.test_client().post('/api/questions/search', json={'searchTerm': 'title'})
+            statuses[name] = res.status_code
+
+        def metric(name):
+            body = app.test_client().get('/metrics').data.decode()
+            for line in body.splitlines():
+                if line.startswith(name + ' '):
+                    return float(line.rsplit(' ', 1)[1])
+            return None
+
+        def wait_for(name, value):
+            deadline = time.monotonic() + 5
+            while metric(name) != value and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        endpoint = '{endpoint="get_question_by_search"}'
+        threads = {name: threading.Thread(target=search, args=(name,))
+                   for name in ('holder', 'waiter', 'shed')}
+        threads['holder'].start()
+        wait_for('trivia_admission_active' + endpoint, 1)
+        threads['waiter'].start()
+        wait_for('trivia_admission_waiting' + endpoint, 1)
+        threads['shed'].start()
+        wait_for('trivia_admission_waiting' + endpoint, 2)
+        # the first queued request takes the freed slot and holds it past the timeout of the second
+        events[0].set()
+        threads['shed'].join(5)
+        events[1].set()
+        for thread in threads.values():
+            thread.join(5)
+
+        self.assertEqual(statuses, {'holder': 200, 'waiter': 200, 'shed': 503})
+        self.assertEqual(metric('trivia_admission_admitted_total' + endpoint), 2)
+        self.assertEqual(metric(
+            'trivia_admission_shed_total{endpoint="get_question_by_search",reason="queue_timeout"}'), 1)
+        self.assertEqual(metric(
+            'trivia_admission_shed_total{endpoint="get_question_by_search",reason="queue_full"}'), 0)
+        self.assertEqual(metric('trivia_admission_active' + endpoint), 0)
+        self.assertEqual(metric('trivia_admission_waiting' + endpoint), 0)
+        self.assertGreaterEqual(metric('trivia_admission_queue_seconds_total' + endpoint), 1.0)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
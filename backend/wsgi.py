@@ -0,0 +1,15 @@
+import importlib
+import time
+
+
+"""
+WSGI entry point
+    creates the api app for WSGI servers, e.g. gunicorn wsgi:app, and times
+    the import of flaskr and its dependencies, reported as the import phase
+    of trivia_boot_seconds.
+"""
+
+
+started = time.perf_counter()
+flaskr = importlib.import_module('flaskr')
+app = flaskr.create_app({'IMPORT_SECONDS': time.perf_counter() - started})